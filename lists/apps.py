@@ -5,3 +5,12 @@ from django.apps import AppConfig
 
 class ListsConfig(AppConfig):
     name = 'lists'
+
+    def ready(self):
+        # connect the signal handlers
+        from . import signals
+        from django.core.signals import request_started
+        from .db import check_connections
+        from .metrics import instrument_db
+        request_started.connect(check_connections)
+        instrument_db()
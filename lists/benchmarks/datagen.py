@@ -0,0 +1,134 @@
+"""Synthetic topics, lists and items for the benchmarks.
+
+generate() builds a topic DAG in layers: every topic below the roots has one
+parent on the layer above it and, with probability extraParents, a second
+one further up, so the graph has shared descendants but no cycle. Lists are
+spread over the topics at random, each with the same number of items.
+
+Rows are written with bulk_create, which skips the indexing and statistics
+signal handlers; the closure table, topic statistics and snapshots of
+published lists are rebuilt once at the end instead. Run it inside a
+transaction that is rolled back afterwards (see the benchmark command) to
+leave the database as it was.
+"""
+import random
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from lists.models import List, ListItem, ListSnapshot, TopicEdge, TopicListStats, TopicNode
+
+# ListCreateView saves lists as this user
+CREATOR = 'faria'
+
+WORDS = ('graph', 'protein', 'signal', 'neuron', 'kernel', 'lattice', 'market',
+         'theory', 'vector', 'climate', 'enzyme', 'circuit', 'language', 'memory')
+
+
+class Dataset(object):
+    def __init__(self, topicIds, levels, listIds, publishedIds, user):
+        self.topicIds = topicIds
+        # levels[d] holds the ids of the topics at depth d
+        self.levels = levels
+        self.listIds = listIds
+        self.publishedIds = publishedIds
+        self.user = user
+
+    @property
+    def roots(self):
+        return self.levels[0]
+
+    @property
+    def draftIds(self):
+        published = set(self.publishedIds)
+        return [pk for pk in self.listIds if pk not in published]
+
+
+def topicName(rng, i):
+    return '%s %s %d' % (rng.choice(WORDS).title(), rng.choice(WORDS), i)
+
+
+def layout(topics, depth, fanout):
+    """Returns the parent index of each of topics nodes (None for roots) and
+    its level, filling every node up to fanout children, breadth first, down
+    to depth levels below the roots. Starts another root when a tree is full."""
+    parents = []
+    levels = []
+    queue = []
+    head = 0
+    while len(parents) < topics:
+        if head == len(queue):
+            queue.append(len(parents))
+            parents.append(None)
+            levels.append(0)
+            continue
+        node = queue[head]
+        head += 1
+        if levels[node] >= depth:
+            continue
+        for _ in range(fanout):
+            if len(parents) == topics:
+                break
+            queue.append(len(parents))
+            parents.append(node)
+            levels.append(levels[node] + 1)
+    return parents, levels
+
+
+def generate(topics=100, depth=3, fanout=5, lists=100, items=10,
+             published=0.5, extraParents=0.1, seed=0):
+    """Writes the synthetic data and returns its Dataset"""
+    rng = random.Random(seed)
+    parents, levels = layout(topics, depth, fanout)
+    with transaction.atomic():
+        user = User.objects.get_or_create(username=CREATOR)[0]
+        # Django 1.9 bulk_create does not set primary keys; read them back in order
+        prefix = 'bench-%d-' % seed
+        TopicNode.objects.bulk_create(
+            [TopicNode(name=topicName(rng, i), description=prefix + str(i)) for i in range(topics)])
+        topicIds = list(TopicNode.objects.filter(description__startswith=prefix)
+                        .order_by('id').values_list('id', flat=True))[-topics:]
+
+        byLevel = []
+        for i, level in enumerate(levels):
+            if level == len(byLevel):
+                byLevel.append([])
+            byLevel[level].append(topicIds[i])
+        edges = []
+        for i, parent in enumerate(parents):
+            if parent is None:
+                continue
+            edges.append(TopicEdge(parent_id=topicIds[parent], child_id=topicIds[i], description=''))
+            if levels[i] > 1 and rng.random() < extraParents:
+                # any topic at least two levels up keeps the graph acyclic
+                other = rng.choice(byLevel[rng.randrange(levels[i] - 1)])
+                edges.append(TopicEdge(parent_id=other, child_id=topicIds[i], description=''))
+        TopicEdge.objects.bulkImport(edges)
+
+        statuses = [List.PUBLISHED if rng.random() < published else List.DRAFT for _ in range(lists)]
+        List.objects.bulk_create([
+            List(title='%s list %d' % (rng.choice(WORDS).title(), i),
+                 description=prefix + str(i),
+                 topic_id=rng.choice(topicIds),
+                 status=status,
+                 creator=user)
+            for i, status in enumerate(statuses)])
+        rows = list(List.objects.filter(description__startswith=prefix)
+                    .order_by('id').values_list('id', 'status'))[-lists:]
+        listIds = [pk for pk, status in rows]
+        # a pool of texts keeps generation time down to the inserts
+        descriptions = [' '.join(rng.choice(WORDS) for _ in range(12)) for _ in range(64)]
+        deepDives = [' '.join(rng.choice(WORDS) for _ in range(120)) for _ in range(64)]
+        for start in range(0, len(listIds), 100):
+            ListItem.objects.bulk_create([
+                ListItem(list_id=listId, _order=order,
+                         title='%s item %d' % (rng.choice(WORDS).title(), order),
+                         description=rng.choice(descriptions),
+                         deepDive=rng.choice(deepDives))
+                for listId in listIds[start:start + 100] for order in range(items)])
+
+        TopicListStats.objects.recompute()
+        publishedIds = [pk for pk, status in rows if status == List.PUBLISHED]
+        for listId in publishedIds:
+            ListSnapshot.objects.refresh(listId)
+    return Dataset(topicIds, byLevel, listIds, publishedIds, user)
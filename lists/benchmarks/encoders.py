@@ -0,0 +1,56 @@
+"""Times the JSON encoder backends on a payload shaped like a ListItemsView
+response. Runs without Django settings:
+
+    $ python -m lists.benchmarks.encoders --items 1000 --repeat 50
+"""
+from __future__ import print_function
+
+import argparse
+import datetime
+import timeit
+
+from lists.encoders import BACKENDS
+
+
+def make_payload(items):
+    now = datetime.datetime(2016, 7, 30, 16, 43, 12, 345678)
+    return {
+        'listItems': [{
+            'id': i,
+            '_order': i,
+            'title': 'Item %d' % i,
+            'description': 'A short description of item %d' % i,
+            'deepDive': 'A much longer text. ' * 20,
+            'list_id': 1,
+            'dateCreated': now,
+            'dateModified': now + datetime.timedelta(seconds=i),
+        } for i in range(items)],
+        'next': None,
+    }
+
+
+def run(items=1000, repeat=50):
+    """Returns {backend name: seconds per dumps() call} for the available backends"""
+    payload = make_payload(items)
+    results = {}
+    for name, backend in sorted(BACKENDS.items()):
+        try:
+            encoder = backend()
+        except ImportError:
+            continue
+        results[name] = min(timeit.repeat(lambda: encoder.dumps(payload),
+                                          number=1, repeat=repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    for name, seconds in sorted(run(args.items, args.repeat).items()):
+        print('%-8s %8.2f ms' % (name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Times the hot endpoints and topic queries on synthetic data.
+
+For each scale, datagen.generate() writes the data, then every operation is
+timed repeat times, cycling through different lists, topics or prefixes, and
+summarized as milliseconds per call. Views are called directly with a
+RequestFactory request, so middleware is not included. Run it through the
+benchmark management command, which rolls the data back afterwards.
+"""
+from __future__ import division
+
+import datetime
+import platform
+import random
+import subprocess
+import time
+
+import django
+from django.db import connection
+from django.test import RequestFactory
+
+from lists.memsearch import MemorySearchBackend
+from lists.models import TopicEdge, TopicNode
+from lists.search import ElasticsearchBackend, PostgresSearchBackend
+from lists.views import ListCreateView, ListItemsView
+
+from . import datagen
+
+SCALES = {
+    'small': dict(topics=100, depth=3, fanout=5, lists=100, items=10),
+    'medium': dict(topics=1000, depth=5, fanout=6, lists=1000, items=50),
+    'large': dict(topics=10000, depth=6, fanout=8, lists=2000, items=200),
+}
+
+# suggest needs the synthetic topics to be searchable: the Elasticsearch
+# backend only sees them once they are indexed, the memory backend loads them
+# on first use
+SUGGEST_BACKENDS = {
+    'postgres': PostgresSearchBackend,
+    'elasticsearch': ElasticsearchBackend,
+    'memory': MemorySearchBackend,
+}
+
+
+def measure(func, repeat):
+    """Calls func(i) for i in range(repeat) and summarizes the durations in ms"""
+    durations = []
+    for i in range(repeat):
+        start = time.time()
+        func(i)
+        durations.append((time.time() - start) * 1000)
+    durations.sort()
+    return {
+        'calls': repeat,
+        'min': durations[0],
+        'median': durations[len(durations) // 2],
+        'p95': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+        'mean': sum(durations) / len(durations),
+    }
+
+
+def read_response(response):
+    if response.streaming:
+        return b''.join(response.streaming_content)
+    return response.content
+
+
+def run_scale(params, repeat, backend, seed=0):
+    """Generates a dataset of the params scale and returns its timings"""
+    start = time.time()
+    data = datagen.generate(seed=seed, **params)
+    result = {'params': params, 'generateSeconds': time.time() - start, 'timings': {}}
+    timings = result['timings']
+    rng = random.Random(seed)
+    factory = RequestFactory()
+    listItems = ListItemsView.as_view()
+    listCreate = ListCreateView.as_view()
+
+    def items(listIds, query=''):
+        picks = [rng.choice(listIds) for _ in range(repeat)]
+        return lambda i: read_response(listItems(factory.get('/' + query), pk=picks[i]))
+
+    for status, listIds in (('draft', data.draftIds), ('published', data.publishedIds)):
+        if listIds:
+            timings['listItems.%s' % status] = measure(items(listIds), repeat)
+            timings['listItems.%s.stream' % status] = measure(items(listIds, '?stream=1'), repeat)
+
+    form = {'title': 'Benchmark list', 'description': '', 'topic': data.topicIds[0]}
+    for i in range(params['items']):
+        form['item-%d-title' % i] = 'Benchmark item %d' % i
+        form['item-%d-description' % i] = 'A short description'
+    timings['listCreate'] = measure(
+        lambda i: read_response(listCreate(factory.post('/', form))), repeat)
+
+    names = dict(TopicNode.objects.filter(id__in=data.topicIds).values_list('id', 'name'))
+    prefixes = [names[rng.choice(data.topicIds)][:rng.randint(1, 4)] for _ in range(repeat)]
+    suggest = SUGGEST_BACKENDS[backend]()
+    # the memory backend loads the index on its first call
+    suggest.suggest(prefixes[0])
+    timings['suggest.%s' % backend] = measure(lambda i: suggest.suggest(prefixes[i]), repeat)
+
+    edges = TopicEdge.objects
+    roots = [rng.choice(data.roots) for _ in range(repeat)]
+    middle = data.levels[len(data.levels) // 2]
+    inner = [rng.choice(middle) for _ in range(repeat)]
+    deepest = [rng.choice(data.levels[-1]) for _ in range(repeat)]
+    timings['getDescendants.root'] = measure(lambda i: edges.getDescendants(roots[i]), repeat)
+    timings['getDescendants.inner'] = measure(lambda i: edges.getDescendants(inner[i]), repeat)
+    timings['isAncestorOf'] = measure(lambda i: edges.isAncestorOf(roots[i], deepest[i]), repeat)
+    return result
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def describe(repeat, backend):
+    """Returns what a run depends on besides the code, to tell runs apart"""
+    return {
+        'created': datetime.datetime.utcnow().isoformat(),
+        'revision': revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'repeat': repeat,
+        'suggestBackend': backend,
+        'scales': {},
+    }
+
+
+def compare(old, new):
+    """Yields (scale, operation, old median, new median) for the timings of
+    new that old has too"""
+    for scale, result in sorted(new['scales'].items()):
+        previous = old.get('scales', {}).get(scale, {}).get('timings', {})
+        for name, timing in sorted(result['timings'].items()):
+            if name in previous:
+                yield scale, name, previous[name]['median'], timing['median']
@@ -0,0 +1,133 @@
+"""In-process and shared caches for hot read paths."""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class LRUCache(object):
+    """A bounded, thread-safe LRU mapping whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                return None
+            # re-insert to mark as most recently used
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + (self.ttl if ttl is None else ttl))
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SuggestCache(object):
+    """Caches serialized autocomplete responses by normalized term prefix.
+
+    Entries live in a local LRU and, if settings.SUGGEST_CACHE_ALIAS names a
+    Django cache, in that shared cache too. Keys include a generation counter
+    that invalidate() bumps whenever topics are written to the index. With a
+    shared cache the counter lives there; without one it is the 'suggest'
+    VersionStamp row, which each process re-reads at most every
+    SUGGEST_CACHE_CHECK_INTERVAL seconds. Either way a bump from any process,
+    management commands included, invalidates every worker.
+    """
+    GENERATION_KEY = 'suggest:generation'
+    VERSION_STAMP = 'suggest'
+
+    def __init__(self):
+        self.ttl = settings.SUGGEST_CACHE_TTL
+        self.local = LRUCache(settings.SUGGEST_CACHE_SIZE, self.ttl)
+        self.alias = settings.SUGGEST_CACHE_ALIAS
+        self._generation = 0
+        self._checked = 0
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    @staticmethod
+    def normalize(term):
+        # completion inputs are capped at max_input_length in the mapping
+        return ' '.join(term.lower().split())[:30]
+
+    def generation(self):
+        """Returns the current generation. Read it before looking a term up
+        and pass it to set(), so a response computed while an invalidation
+        landed is stored under the generation it was computed at."""
+        if self.shared is not None:
+            return self.shared.get(self.GENERATION_KEY, 0)
+        from .models import VersionStamp
+        now = time.time()
+        if now - self._checked >= settings.SUGGEST_CACHE_CHECK_INTERVAL:
+            self._generation = VersionStamp.objects.current(self.VERSION_STAMP)
+            self._checked = now
+        return self._generation
+
+    def _shared_key(self, generation, term):
+        digest = hashlib.md5(term.encode('utf-8')).hexdigest()
+        return 'suggest:%d:%s' % (generation, digest)
+
+    def get(self, term, generation=None):
+        term = self.normalize(term)
+        if generation is None:
+            generation = self.generation()
+        data = self.local.get((generation, term))
+        if data is None and self.shared is not None:
+            data = self.shared.get(self._shared_key(generation, term))
+            if data is not None:
+                self.local.set((generation, term), data)
+        return data
+
+    def set(self, term, data, generation=None, ttl=None):
+        term = self.normalize(term)
+        if generation is None:
+            generation = self.generation()
+        self.local.set((generation, term), data, ttl)
+        if self.shared is not None:
+            self.shared.set(self._shared_key(generation, term), data,
+                            self.ttl if ttl is None else ttl)
+
+    def invalidate(self):
+        self.local.clear()
+        if self.shared is None:
+            from .models import VersionStamp
+            VersionStamp.objects.bump(self.VERSION_STAMP)
+            self._checked = 0
+            return
+        try:
+            self.shared.incr(self.GENERATION_KEY)
+        except ValueError:
+            # the counter was never set or got evicted; restart it from
+            # the clock so it does not fall back onto a used generation
+            self.shared.set(self.GENERATION_KEY, int(time.time()), None)
+
+
+suggest_cache = SuggestCache()
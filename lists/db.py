@@ -0,0 +1,95 @@
+"""Database helpers that go below the ORM, and connection management.
+
+Connections persist across requests for DATABASES CONN_MAX_AGE seconds.
+check_connections() runs at the start of every request and replaces those
+that were dropped while idle.
+
+Nothing relies on session state, so the app can run behind a pgbouncer in
+transaction pooling mode, where the server connection may change between
+transactions:
+  - psycopg2 sends no server-side prepared statements, and raw queries here
+    are plain parameterized statements run through `with connection.cursor()`
+  - streams (iter_keyset) read short keyset chunks instead of holding a
+    named cursor, and its transaction, open
+  - Django sets the session time zone on connect when the server default
+    differs from settings.TIME_ZONE; `manage.py check --deploy` warns about
+    that (lists.W001), fix it with ALTER DATABASE ... SET timezone
+"""
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.db import connections
+
+from .metrics import count_stream_query
+
+def iter_keyset(qset, fields, key, chunk_size=None):
+    """Yields a dict of fields for every row of qset, in order of key.
+
+    key must be one of fields and unique within qset. The rows are read in
+    chunks of chunk_size (default settings.STREAM_CHUNK_SIZE), each a separate
+    query resuming after the last key read, so memory stays bounded and no
+    transaction or cursor is held open while a slow client reads the stream.
+    Rows committed between two chunks are included if they sort after the
+    rows already sent. The queries after the first grow with the number of
+    rows, so they are not charged to the view's query budget.
+    """
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    values = qset.order_by(key).values(*fields)
+    last = None
+    while True:
+        if last is None:
+            chunk = values
+        else:
+            chunk = values.filter(**{key + '__gt': last})
+            count_stream_query()
+        rows = list(chunk[:chunk_size])
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][key]
+
+
+def check_connections(**kwargs):
+    """request_started handler. Django reuses a persistent connection until
+    CONN_MAX_AGE passes even if it was closed on the other end, and the first
+    query of the request would fail. Pings connections that were not checked
+    for DB_HEALTH_CHECK_INTERVAL seconds and closes the broken ones, which
+    then reconnect on first use."""
+    now = time.time()
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if now - getattr(connection, 'healthChecked', 0) < settings.DB_HEALTH_CHECK_INTERVAL:
+            continue
+        if not connection.is_usable():
+            connection.close()
+        connection.healthChecked = now
+
+
+@checks.register('database', deploy=True)
+def check_transaction_pooling(app_configs, **kwargs):
+    """Warns about session state set on connect, which leaks to other clients
+    under transaction pooling"""
+    errors = []
+    for connection in connections.all():
+        if connection.vendor != 'postgresql' or not connection.timezone_name:
+            continue
+        # a raw connection, before Django sets the time zone on it
+        raw = connection.get_new_connection(connection.get_connection_params())
+        try:
+            serverZone = raw.get_parameter_status('TimeZone')
+        finally:
+            raw.close()
+        if serverZone != connection.timezone_name:
+            errors.append(checks.Warning(
+                'Database %r defaults to time zone %s, so every new connection '
+                'sets it to %s. Behind a transaction pooler that setting leaks '
+                'to other clients of the pooled server connection.' % (
+                    connection.alias, serverZone, connection.timezone_name),
+                hint="ALTER DATABASE %s SET timezone TO '%s'" % (
+                    connection.settings_dict['NAME'], connection.timezone_name),
+                id='lists.W001',
+            ))
+    return errors
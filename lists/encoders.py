@@ -0,0 +1,87 @@
+"""Pluggable JSON encoder backends for JSONResponseMixin.
+
+settings.JSON_ENCODER picks the backend: 'stdlib', 'orjson', a dotted path to
+an encoder class, or 'auto' (the default), which uses orjson when it is
+installed and the standard library otherwise. Every backend renders datetimes
+like json_serial: ISO 8601 with the microseconds dropped.
+"""
+import datetime
+import json
+from importlib import import_module
+
+
+def json_serial(obj):
+    if isinstance(obj, datetime.datetime):
+        # for consistency, and to save space, don't return microseconds
+        date = obj.replace(microsecond=0)
+        return date.isoformat()
+    # subclasses of the builtin types, which orjson passes through: Django's
+    # ErrorList keeps its items in .data, not in its list storage
+    elif isinstance(obj, dict):
+        return dict(obj)
+    elif isinstance(obj, (list, tuple)):
+        return list(obj)
+    elif isinstance(obj, str):
+        return str(obj)
+    elif isinstance(obj, int) and not isinstance(obj, bool):
+        return int(obj)
+    else:
+        raise TypeError ("Type not serializable")
+
+
+class StdlibEncoder(object):
+    name = 'stdlib'
+
+    def dumps(self, obj):
+        return json.dumps(obj, default=json_serial)
+
+
+class OrjsonEncoder(object):
+    """C-accelerated encoder. Serializes datetimes natively, so json_serial is
+    only called for types orjson does not know and for subclasses of dict,
+    list, str and int, which orjson would otherwise read from their builtin
+    storage, ignoring overridden methods."""
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._dumps = orjson.dumps
+        self._options = (orjson.OPT_OMIT_MICROSECONDS | orjson.OPT_NON_STR_KEYS |
+                         orjson.OPT_PASSTHROUGH_SUBCLASS)
+
+    def dumps(self, obj):
+        return self._dumps(obj, default=json_serial, option=self._options).decode('utf-8')
+
+
+BACKENDS = {
+    'stdlib': StdlibEncoder,
+    'orjson': OrjsonEncoder,
+}
+
+
+def load_encoder(name):
+    """Instantiates the encoder backend called name (see module docstring)"""
+    if name == 'auto':
+        try:
+            return OrjsonEncoder()
+        except ImportError:
+            return StdlibEncoder()
+    if name in BACKENDS:
+        return BACKENDS[name]()
+    module_name, class_name = name.rsplit('.', 1)
+    return getattr(import_module(module_name), class_name)()
+
+
+_encoder = None
+
+
+def get_encoder():
+    global _encoder
+    if _encoder is None:
+        from django.conf import settings
+        _encoder = load_encoder(getattr(settings, 'JSON_ENCODER', 'auto'))
+    return _encoder
+
+
+def dumps(obj):
+    return get_encoder().dumps(obj)
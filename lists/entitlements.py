@@ -0,0 +1,175 @@
+"""Precomputed topic entitlements of subscribers.
+
+A Subscription grants its SubscriberGroup access to a topic and all of its
+subtopics. The resolver expands the active, unexpired subscriptions of each
+group once into sorted arrays of topic ids, using the in-memory TopicGraph
+for the subtopics, and keeps the union per person as frozensets so checking
+a List is a constant time set lookup.
+
+Cached entries are dropped when the 'entitlements' VersionStamp (bumped by
+Subscription and Subscriber writes) or the TopicGraph version changes, and
+when the earliest dateExpire they relied on passes.
+
+No view calls the resolver yet: the views do not authenticate users, and
+lists are served to everyone until they do.
+"""
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import LRUCache
+from .topicgraph import get_topic_graph
+
+VERSION_STAMP = 'entitlements'
+
+
+class GroupEntitlements(object):
+    """The topic ids a SubscriberGroup may view and edit, as sorted int arrays"""
+
+    def __init__(self, viewTopics, editTopics, validUntil=None):
+        self.viewTopics = array('i', sorted(viewTopics))
+        self.editTopics = array('i', sorted(editTopics))
+        self.validUntil = validUntil
+
+
+class PersonEntitlements(object):
+    """What a single user may see and edit, following the review rules above List"""
+
+    def __init__(self, user_id, groups):
+        self.user_id = user_id
+        viewTopics, editTopics = set(), set()
+        expiries = []
+        for group in groups:
+            viewTopics.update(group.viewTopics)
+            editTopics.update(group.editTopics)
+            if group.validUntil is not None:
+                expiries.append(group.validUntil)
+        self.viewTopics = frozenset(viewTopics)
+        self.editTopics = frozenset(editTopics)
+        self.validUntil = min(expiries) if expiries else None
+
+    def canViewTopic(self, topic_id):
+        return topic_id in self.viewTopics
+
+    def canEditTopic(self, topic_id):
+        return topic_id in self.editTopics
+
+    def canView(self, lst):
+        from .models import List
+        if lst.creator_id is not None and lst.creator_id == self.user_id:
+            return True
+        if lst.status == List.DRAFT:
+            return False
+        if lst.status == List.SUBMITTED:
+            # submitted lists are only visible to the editors of their topic
+            return lst.topic_id in self.editTopics
+        return lst.topic_id in self.viewTopics
+
+    def canEdit(self, lst):
+        from .models import List
+        if lst.status == List.PUBLISHED:
+            return False
+        if lst.status == List.DRAFT:
+            return lst.creator_id is not None and lst.creator_id == self.user_id
+        return lst.topic_id in self.editTopics
+
+    def filterLists(self, lists):
+        return [lst for lst in lists if self.canView(lst)]
+
+
+def computeGroupEntitlements(group_ids):
+    """Expands the currently valid subscriptions of group_ids. Returns a dict
+    of group id to GroupEntitlements. Runs one query."""
+    from .models import Subscription
+    now = timezone.now()
+    graph = get_topic_graph()
+    subscriptions = Subscription.objects.filter(group_id__in=group_ids, active=True).filter(
+        Q(dateExpire__isnull=True) | Q(dateExpire__gt=now)
+    ).values_list('group_id', 'topic_id', 'editPower', 'dateExpire')
+    expanded = dict((group_id, (set(), set(), [])) for group_id in group_ids)
+    for group_id, topic_id, editPower, dateExpire in subscriptions:
+        viewTopics, editTopics, expiries = expanded[group_id]
+        topics = graph.descendants(topic_id)
+        topics.add(topic_id)
+        viewTopics.update(topics)
+        if editPower:
+            editTopics.update(topics)
+        if dateExpire is not None:
+            expiries.append(dateExpire)
+    return dict(
+        (group_id, GroupEntitlements(viewTopics, editTopics, min(expiries) if expiries else None))
+        for group_id, (viewTopics, editTopics, expiries) in expanded.items()
+    )
+
+
+class EntitlementResolver(object):
+    def __init__(self):
+        self._groups = {}
+        self._people = LRUCache(settings.ENTITLEMENTS_CACHE_SIZE, settings.ENTITLEMENTS_CACHE_TTL)
+        self._version = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def _checkVersion(self):
+        from .models import VersionStamp
+        now = time.time()
+        if now - self._checked < settings.ENTITLEMENTS_CHECK_INTERVAL:
+            return
+        version = (VersionStamp.objects.current(VERSION_STAMP), get_topic_graph().version)
+        with self._lock:
+            if version != self._version:
+                self._groups = {}
+                self._people.clear()
+                self._version = version
+            self._checked = now
+
+    def invalidate(self):
+        self._checked = 0
+
+    def forGroups(self, group_ids):
+        """Returns GroupEntitlements for each of group_ids, computing missing ones in one query"""
+        now = timezone.now()
+        with self._lock:
+            groups = self._groups
+            missing = [group_id for group_id in group_ids
+                       if group_id not in groups
+                       or (groups[group_id].validUntil is not None and groups[group_id].validUntil <= now)]
+            found = dict((group_id, groups[group_id]) for group_id in group_ids
+                         if group_id not in missing)
+        if missing:
+            computed = computeGroupEntitlements(missing)
+            found.update(computed)
+            with self._lock:
+                # _checkVersion may have dropped the cache while computing
+                if self._groups is groups:
+                    groups.update(computed)
+        return [found[group_id] for group_id in group_ids]
+
+    def forUser(self, user_id):
+        """Returns the PersonEntitlements of user_id"""
+        from .models import Subscriber
+        self._checkVersion()
+        entitlements = self._people.get(user_id)
+        if entitlements is not None and (
+                entitlements.validUntil is None or entitlements.validUntil > timezone.now()):
+            return entitlements
+        group_ids = list(Subscriber.objects.filter(person_id=user_id).values_list('group_id', flat=True))
+        entitlements = PersonEntitlements(user_id, self.forGroups(group_ids))
+        self._people.set(user_id, entitlements)
+        return entitlements
+
+
+resolver = EntitlementResolver()
+
+
+def subscriptions_changed():
+    """Marks every worker's cached entitlements as outdated. Call inside the
+    transaction that wrote Subscription or Subscriber rows."""
+    from .models import VersionStamp
+    VersionStamp.objects.bump(VERSION_STAMP)
+    transaction.on_commit(resolver.invalidate)
@@ -0,0 +1,75 @@
+"""The Elasticsearch client shared by search and indexing.
+
+get_client() creates one client per process on first use, so nothing
+connects at import time and forked workers do not share sockets. Nodes are
+taken from settings.ES_HOSTS as listed, without sniffing. Each node gets a
+urllib3 pool of ES_POOL_SIZE keep-alive connections, sized to the number of
+threads that may call it at once so connections are reused instead of being
+opened and discarded under load.
+
+Calls time out after ES_TIMEOUT seconds unless they pass request_timeout,
+and timed out calls are retried on the next node up to ES_MAX_RETRIES times.
+"""
+import threading
+
+from django.conf import settings
+from elasticsearch import Elasticsearch, Urllib3HttpConnection
+
+from .metrics import InstrumentedTransport
+
+_client = None
+_lock = threading.Lock()
+
+
+def create_client(**overrides):
+    """Returns a new client configured from settings; keyword arguments
+    override the Elasticsearch/Transport/connection options"""
+    options = dict(
+        transport_class=InstrumentedTransport,
+        connection_class=Urllib3HttpConnection,
+        maxsize=settings.ES_POOL_SIZE,
+        timeout=settings.ES_TIMEOUT,
+        max_retries=settings.ES_MAX_RETRIES,
+        retry_on_timeout=True,
+        sniff_on_start=False,
+        sniff_on_connection_fail=False,
+        sniffer_timeout=None,
+    )
+    options.update(overrides)
+    return Elasticsearch(settings.ES_HOSTS, **options)
+
+
+def get_client():
+    """Returns this process's shared client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+
+def pool_stats(client=None):
+    """Returns the state of the connection pool of every configured node:
+    whether it is alive, its pool size, the connections opened and requests
+    sent so far, and how many idle connections are waiting for reuse."""
+    client = client or _client
+    if client is None:
+        return []
+    pool = client.transport.connection_pool
+    # a single node gets a DummyConnectionPool, which never marks it dead
+    connections = getattr(pool, 'orig_connections', pool.connections)
+    deadCount = getattr(pool, 'dead_count', {})
+    stats = []
+    for connection in connections:
+        http = connection.pool
+        stats.append({
+            'host': connection.host,
+            'alive': connection in pool.connections,
+            'failures': deadCount.get(connection, 0),
+            'maxsize': http.pool.maxsize if http.pool is not None else 0,
+            'idle': http.pool.qsize() if http.pool is not None else 0,
+            'connections': http.num_connections,
+            'requests': http.num_requests,
+        })
+    return stats
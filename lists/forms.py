@@ -1,3 +1,4 @@
+from django import forms
 from django.forms import Form, ModelForm
 
 from .models import *
@@ -11,3 +12,14 @@ class ListItemCreateForm(ModelForm):
     class Meta:
         model = ListItem
         fields = ['title','description','deepDive']
+
+class ListQueryForm(Form):
+    """Query string parameters of ListQueryView"""
+    q = forms.CharField(required=False, max_length=200)
+    status = forms.ChoiceField(required=False, choices=List.STATUS_CHOICES)
+    active = forms.NullBooleanField(required=False)
+    topic = forms.IntegerField(required=False)
+    dateFrom = forms.DateTimeField(required=False)
+    dateTo = forms.DateTimeField(required=False)
+    size = forms.IntegerField(required=False, min_value=1, max_value=100)
+    cursor = forms.CharField(required=False)
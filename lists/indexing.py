@@ -0,0 +1,328 @@
+"""Helpers for pushing es_repr() documents into Elasticsearch in bulk.
+
+Functions that take a client also accept an in-process index that has a
+bulk_actions() method, such as memsearch.MemorySearchBackend; bulk writes
+are then applied to it instead.
+"""
+from django.apps import apps
+from django.conf import settings
+from elasticsearch import helpers
+
+from .cache import suggest_cache
+
+DEFAULT_CHUNK_SIZE = 500
+# outbox replays and count checks before rebuild_index gives up
+VERIFY_ATTEMPTS = 3
+
+
+def get_indexed_models():
+    """Returns the models that declare an es_mapping in their Meta"""
+    return [model for model in apps.get_app_config('lists').get_models()
+            if getattr(model._meta, 'es_mapping', None)]
+
+
+def get_index_mappings(models=None):
+    """Builds the index mappings body from the models' Meta declarations"""
+    mappings = {}
+    for model in models or get_indexed_models():
+        mappings[model._meta.es_type_name] = model._meta.es_mapping
+    return mappings
+
+
+def create_index(client, index_name=None, models=None, index_settings=None):
+    """Creates the index with the declared mappings if it does not exist yet"""
+    index_name = index_name or settings.INDEX_NAME
+    if client.indices.exists(index=index_name):
+        return False
+    body = {'mappings': get_index_mappings(models)}
+    if index_settings:
+        body['settings'] = index_settings
+    client.indices.create(index=index_name, body=body)
+    return True
+
+
+def versioned_index_name(alias, version):
+    return '%s_v%d' % (alias, version)
+
+
+def get_index_versions(client, alias=None):
+    """Returns sorted (version, index name) pairs of the versioned indices behind alias"""
+    alias = alias or settings.INDEX_NAME
+    prefix = alias + '_v'
+    indices = client.indices.get(index=prefix + '*', ignore=404)
+    versions = []
+    for name in indices:
+        suffix = name[len(prefix):]
+        if name.startswith(prefix) and suffix.isdigit():
+            versions.append((int(suffix), name))
+    return sorted(versions)
+
+
+def get_alias_targets(client, alias=None):
+    """Returns the names of the indices that alias currently points to"""
+    alias = alias or settings.INDEX_NAME
+    if not client.indices.exists_alias(name=alias):
+        return []
+    return list(client.indices.get_alias(name=alias).keys())
+
+
+def verify_counts(client, index_name):
+    """Checks that index_name holds a document for every row of each indexed
+    model. Raises ValueError on the first mismatch."""
+    client.indices.refresh(index=index_name)
+    for model in get_indexed_models():
+        doc_type = model._meta.es_type_name
+        count = model._default_manager.count()
+        found = client.count(index=index_name, doc_type=doc_type)['count']
+        if found != count:
+            raise ValueError('%s/%s holds %d documents, expected %d' % (
+                index_name, doc_type, found, count))
+
+
+def swap_alias(client, new_index, alias=None):
+    """Atomically repoints alias from its current indices to new_index.
+
+    A concrete (non-alias) index that still uses the alias name, as created
+    before indices were versioned, is deleted first since an alias cannot
+    share its name.
+    """
+    alias = alias or settings.INDEX_NAME
+    targets = get_alias_targets(client, alias)
+    if not targets and client.indices.exists(index=alias):
+        client.indices.delete(index=alias)
+    actions = [{'remove': {'index': name, 'alias': alias}}
+               for name in targets if name != new_index]
+    actions.append({'add': {'index': new_index, 'alias': alias}})
+    client.indices.update_aliases(body={'actions': actions})
+
+
+def prune_versions(client, alias=None, keep=1):
+    """Deletes old versioned indices that the alias no longer points to.
+
+    The newest keep versions besides the live ones are retained for rollback.
+    Returns the names of the deleted indices.
+    """
+    live = set(get_alias_targets(client, alias))
+    old = [name for version, name in get_index_versions(client, alias)
+           if name not in live]
+    stale = old[:-keep] if keep > 0 else old
+    for name in stale:
+        client.indices.delete(index=name)
+    return stale
+
+
+def prepare_queryset(queryset):
+    """Applies the model's forIndexing() batching to queryset, if it has one"""
+    manager = queryset.model._default_manager
+    if hasattr(manager, 'forIndexing'):
+        queryset = manager.forIndexing(queryset)
+    return queryset
+
+
+def iter_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields the objects of queryset, evaluated in pk ordered chunks.
+
+    Unlike iterator(), which ignores prefetch_related(), each chunk runs the
+    queryset's prefetches once, so memory stays bounded and the number of
+    queries is constant per chunk.
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk_qs = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_qs[:chunk_size])
+        if not chunk:
+            return
+        for obj in chunk:
+            yield obj
+        last_pk = chunk[-1].pk
+
+
+def iter_documents(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Batch serializer: yields es_repr() of every object in queryset"""
+    for obj in iter_chunks(prepare_queryset(queryset), chunk_size):
+        yield obj.es_repr()
+
+
+def iter_es_actions(queryset, index_name=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields bulk index actions for every object in queryset"""
+    meta = queryset.model._meta
+    index_name = index_name or meta.es_index_name
+    for action in iter_documents(queryset, chunk_size):
+        action['_index'] = index_name
+        action['_type'] = meta.es_type_name
+        yield action
+
+
+def bulk_index(client, actions, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    """Sends actions to Elasticsearch with the bulk helper.
+
+    Returns a tuple (number of successful actions, list of errors).
+    """
+    if hasattr(client, 'bulk_actions'):
+        return client.bulk_actions(actions)
+    if workers > 1:
+        success, errors = 0, []
+        for ok, info in helpers.parallel_bulk(client, actions,
+                                              thread_count=workers,
+                                              chunk_size=chunk_size,
+                                              raise_on_error=False,
+                                              request_timeout=settings.ES_BULK_TIMEOUT):
+            if ok:
+                success += 1
+            else:
+                errors.append(info)
+        return success, errors
+    return helpers.bulk(client, actions, chunk_size=chunk_size,
+                        raise_on_error=False,
+                        request_timeout=settings.ES_BULK_TIMEOUT)
+
+
+def reindex_model(client, model, index_name=None,
+                  chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    """Indexes every row of model. Returns (success count, errors)"""
+    queryset = model._default_manager.all()
+    actions = iter_es_actions(queryset, index_name, chunk_size)
+    result = bulk_index(client, actions, chunk_size, workers)
+    if index_name is None and model._meta.es_type_name == 'topicnode':
+        # topics were written to the live index
+        suggest_cache.invalidate()
+    return result
+
+
+def rebuild_index(client, alias=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=1,
+                  keep=1, log=None):
+    """Builds a new versioned index, swaps the alias to it and prunes old versions.
+
+    Search traffic keeps reading the previous index through the alias until
+    every document is written and the counts check out. sync_outbox keeps
+    writing to the previous index meanwhile, so the outbox rows queued since
+    the rebuild started are replayed into the new index before the swap;
+    only changes consumed between the last replay and the swap miss it.
+    Returns the name of the new index.
+    """
+    from django.db.models import Max
+    from .models import SearchOutbox
+    alias = alias or settings.INDEX_NAME
+    versions = get_index_versions(client, alias)
+    version = versions[-1][0] + 1 if versions else 1
+    index_name = versioned_index_name(alias, version)
+    # refreshes and replicas are pointless while nobody reads the index
+    create_index(client, index_name, index_settings={
+        'refresh_interval': '-1',
+        'number_of_replicas': 0,
+    })
+    # changes queued after this may be missing from the rows read below
+    replayed = SearchOutbox.objects.aggregate(last=Max('id'))['last'] or 0
+    for model in get_indexed_models():
+        success, errors = reindex_model(client, model, index_name,
+                                        chunk_size, workers)
+        if errors:
+            raise ValueError('%d errors while indexing %s into %s, first: %s' % (
+                len(errors), model._meta.es_type_name, index_name, errors[0]))
+        if log:
+            log('%s: indexed %d documents into %s' % (
+                model._meta.es_type_name, success, index_name))
+    client.indices.put_settings(index=index_name, body={'index': {
+        'refresh_interval': settings.ES_REFRESH_INTERVAL,
+        'number_of_replicas': settings.ES_NUMBER_OF_REPLICAS,
+    }})
+    for attempt in range(VERIFY_ATTEMPTS):
+        replayed = replay_outbox(client, index_name, replayed, chunk_size)
+        try:
+            verify_counts(client, index_name)
+            break
+        except ValueError:
+            # rows written between the replay and the count; replay them too
+            if attempt == VERIFY_ATTEMPTS - 1:
+                raise
+    swap_alias(client, index_name, alias)
+    suggest_cache.invalidate()
+    for name in prune_versions(client, alias, keep):
+        if log:
+            log('Deleted old index %s' % name)
+    return index_name
+
+
+def get_model_for_type(doc_type):
+    for model in get_indexed_models():
+        if model._meta.es_type_name == doc_type:
+            return model
+    raise LookupError('No indexed model with es_type_name %r' % doc_type)
+
+
+def iter_sync_actions(changes, index_name=None):
+    """Yields index actions for the changed documents still in the database and
+    delete actions for the ones that are gone.
+
+    changes maps es_type_name to a set of pks.
+    """
+    from .models import List, TopicNode
+    for doc_type, pks in changes.items():
+        model = get_model_for_type(doc_type)
+        found = set()
+        for action in iter_es_actions(model._default_manager.filter(pk__in=pks), index_name):
+            found.add(action['_id'])
+            yield action
+        for pk in pks - found:
+            yield {
+                '_op_type': 'delete',
+                '_index': index_name or model._meta.es_index_name,
+                '_type': doc_type,
+                '_id': pk,
+            }
+    # topics are embedded in the List documents that reference them
+    topic_pks = changes.get(TopicNode._meta.es_type_name)
+    if topic_pks:
+        list_pks = changes.get(List._meta.es_type_name, set())
+        queryset = List.objects.filter(topic_id__in=topic_pks).exclude(pk__in=list_pks)
+        for action in iter_es_actions(queryset, index_name):
+            yield action
+
+
+def apply_outbox_rows(client, rows, index_name=None, batch_size=DEFAULT_CHUNK_SIZE):
+    """Writes the documents changed by (id, docType, objectId) outbox rows.
+    Returns the changes as a dict of es_type_name to pks. Raises ValueError
+    if any action failed."""
+    changes = {}
+    for row_id, doc_type, object_id in rows:
+        changes.setdefault(doc_type, set()).add(object_id)
+    success, errors = bulk_index(client, iter_sync_actions(changes, index_name), batch_size)
+    # deleting a document that was never indexed is not an error
+    errors = [e for e in errors if e.get('delete', {}).get('status') != 404]
+    if errors:
+        raise ValueError('%d errors while syncing the outbox, first: %s' % (
+            len(errors), errors[0]))
+    return changes
+
+
+def sync_outbox(client, batch_size=DEFAULT_CHUNK_SIZE):
+    """Flushes up to batch_size queued SearchOutbox changes to the index.
+
+    Repeated changes to the same document are coalesced into one action.
+    Outbox rows are only deleted once the bulk request succeeded, so a crashed
+    consumer picks up where it left off. Returns the number of rows consumed.
+    """
+    from .models import SearchOutbox, TopicNode
+    rows = list(SearchOutbox.objects.order_by('id')
+                .values_list('id', 'docType', 'objectId')[:batch_size])
+    if not rows:
+        return 0
+    changes = apply_outbox_rows(client, rows, batch_size=batch_size)
+    SearchOutbox.objects.filter(id__in=[row[0] for row in rows]).delete()
+    if TopicNode._meta.es_type_name in changes:
+        suggest_cache.invalidate()
+    return len(rows)
+
+
+def replay_outbox(client, index_name, after, batch_size=DEFAULT_CHUNK_SIZE):
+    """Applies the SearchOutbox rows queued after row id after to index_name,
+    leaving them for sync_outbox to consume. Returns the last id replayed."""
+    from .models import SearchOutbox
+    while True:
+        rows = list(SearchOutbox.objects.filter(id__gt=after).order_by('id')
+                    .values_list('id', 'docType', 'objectId')[:batch_size])
+        if not rows:
+            return after
+        apply_outbox_rows(client, rows, index_name, batch_size)
+        after = rows[-1][0]
@@ -0,0 +1,67 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from lists.benchmarks import suite
+
+
+class Command(BaseCommand):
+    help = ('Times ListItemsView, ListCreateView, topic suggestions and the '
+            'topic closure queries on synthetic data, at one or more scales, '
+            'and writes the results as JSON. The data is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', dest='scales',
+                            choices=sorted(suite.SCALES) + ['custom'],
+                            help='Data size to run at (repeatable, default small). '
+                                 'custom takes the sizes below.')
+        parser.add_argument('--topics', type=int, default=500)
+        parser.add_argument('--depth', type=int, default=4,
+                            help='Levels of topics below the roots.')
+        parser.add_argument('--fanout', type=int, default=5,
+                            help='Children per topic.')
+        parser.add_argument('--lists', type=int, default=500)
+        parser.add_argument('--items', type=int, default=20,
+                            help='Items per list, and per list created.')
+        parser.add_argument('--repeat', type=int, default=50,
+                            help='Calls timed per operation.')
+        parser.add_argument('--suggest-backend', default='postgres',
+                            choices=sorted(suite.SUGGEST_BACKENDS))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='File the JSON results are written to.')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        previous = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+        results = suite.describe(options['repeat'], options['suggest_backend'])
+        for scale in options['scales'] or ['small']:
+            if scale == 'custom':
+                params = dict((k, options[k]) for k in ('topics', 'depth', 'fanout', 'lists', 'items'))
+            else:
+                params = suite.SCALES[scale]
+            with transaction.atomic():
+                results['scales'][scale] = suite.run_scale(
+                    params, options['repeat'], options['suggest_backend'], options['seed'])
+                transaction.set_rollback(True)
+            self.stdout.write('%s: generated in %.1f s' % (
+                scale, results['scales'][scale]['generateSeconds']))
+            for name, timing in sorted(results['scales'][scale]['timings'].items()):
+                self.stdout.write('  %-28s median %8.2f ms  p95 %8.2f ms' % (
+                    name, timing['median'], timing['p95']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        else:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
+        if previous is not None:
+            self.stdout.write('Median change against %s' % options['compare'])
+            for scale, name, before, after in suite.compare(previous, results):
+                self.stdout.write('  %-8s %-28s %8.2f -> %8.2f ms (%+.0f%%)' % (
+                    scale, name, before, after, (after - before) / before * 100 if before else 0))
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from lists import esclient, indexing
+
+
+class Command(BaseCommand):
+    help = ('Builds a new versioned search index, bulk indexes all searchable '
+            'models into it and swaps the index alias over once it is complete.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int,
+                            default=indexing.DEFAULT_CHUNK_SIZE,
+                            help='Number of documents sent per bulk request.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of parallel bulk request threads.')
+        parser.add_argument('--keep', type=int, default=1,
+                            help='Number of previous index versions kept for rollback.')
+        parser.add_argument('--model', action='append', dest='models',
+                            help='es_type_name of a model to reindex in place into '
+                                 'the live index (repeatable). Skips the versioned '
+                                 'rebuild.')
+
+    def handle(self, *args, **options):
+        # one pooled connection per parallel bulk thread
+        client = esclient.create_client(maxsize=max(options['workers'], settings.ES_POOL_SIZE))
+        if options['models']:
+            self.reindex_in_place(client, options)
+            return
+        try:
+            index_name = indexing.rebuild_index(
+                client,
+                chunk_size=options['chunk_size'],
+                workers=options['workers'],
+                keep=options['keep'],
+                log=self.stdout.write
+            )
+        except ValueError as e:
+            raise CommandError('Rebuild aborted, alias left unchanged: %s' % e)
+        self.stdout.write('%s now points to %s' % (settings.INDEX_NAME, index_name))
+
+    def reindex_in_place(self, client, options):
+        models = [m for m in indexing.get_indexed_models()
+                  if m._meta.es_type_name in options['models']]
+        if not models:
+            raise CommandError('No indexed model matches %s' % options['models'])
+        if not indexing.get_alias_targets(client):
+            raise CommandError('%s does not exist yet, run a full rebuild first'
+                               % settings.INDEX_NAME)
+        for model in models:
+            success, errors = indexing.reindex_model(
+                client, model,
+                chunk_size=options['chunk_size'],
+                workers=options['workers']
+            )
+            self.stdout.write('%s: indexed %d documents, %d errors' % (
+                model._meta.es_type_name, success, len(errors)))
+            for error in errors[:10]:
+                self.stderr.write(str(error))
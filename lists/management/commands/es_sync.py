@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from lists import esclient, indexing
+
+
+class Command(BaseCommand):
+    help = ('Consumes the SearchOutbox and flushes queued changes to the search '
+            'index in bulk batches. Runs until interrupted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=indexing.DEFAULT_CHUNK_SIZE,
+                            help='Maximum number of outbox rows flushed per batch.')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the outbox and exit.')
+
+    def handle(self, *args, **options):
+        client = esclient.get_client()
+        while True:
+            close_old_connections()
+            try:
+                consumed = indexing.sync_outbox(client, options['batch_size'])
+            except Exception as e:
+                # the batch stays queued and is retried on the next pass
+                self.stderr.write('Sync failed: %s' % e)
+                consumed = 0
+                if options['once']:
+                    raise
+            if consumed:
+                self.stdout.write('Flushed %d outbox changes' % consumed)
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from lists.models import List, ListSnapshot
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the ListSnapshot of every published list and removes '
+            'snapshots of lists that are no longer published.')
+
+    def handle(self, *args, **options):
+        published = set(List.objects.filter(status=List.PUBLISHED).values_list('id', flat=True))
+        stale = set(ListSnapshot.objects.values_list('list_id', flat=True)) - published
+        for list_id in sorted(published | stale):
+            ListSnapshot.objects.refresh(list_id)
+        self.stdout.write('Rebuilt %d list snapshots, removed %d' % (len(published), len(stale)))
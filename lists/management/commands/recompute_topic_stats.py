@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from lists.models import TopicListStats
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the per-topic list counts in TopicListStats from the '
+            'List table. Run periodically to repair drift.')
+
+    def handle(self, *args, **options):
+        TopicListStats.objects.recompute()
+        self.stdout.write('Recomputed topic list counts')
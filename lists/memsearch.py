@@ -0,0 +1,441 @@
+"""In-process search backend, for tests, benchmarks and laptops without
+Elasticsearch.
+
+MemorySearchBackend stores the same es_repr() documents that are sent to
+Elasticsearch and answers the same calls as the other backends. suggest()
+looks terms up in a sorted index of the name_complete inputs of topics.
+search() evaluates the body built by build_list_query() itself, through the
+subset of the query DSL that it uses: bool, match_all, term, terms, range,
+match and multi_match, with sort, search_after, from/size, _source filtering
+and highlighting. Text is analyzed as lowercase word tokens, and a field
+scores its boost times the number of distinct query terms it contains. That
+is enough to rank and page like Elasticsearch, not to reproduce its scores.
+
+With sync (the default) the backend loads every indexed model from the
+database on first use, then applies the queued SearchOutbox changes before
+each call, so it replaces es_sync. The index lives in one process: only use
+it with a single worker.
+"""
+import re
+import threading
+from bisect import bisect_left
+from calendar import timegm
+from datetime import date, datetime
+
+from django.utils import six
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import indexing
+from .search import SUGGEST_SIZE, build_list_query, parse_hits
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+# bulk action keys that are not part of the document
+ACTION_KEYS = ('_id', '_index', '_type', '_op_type')
+
+
+def analyze(value):
+    """Splits a text into lowercase word tokens"""
+    return TOKEN.findall(value.lower()) if value else []
+
+
+def to_millis(value):
+    """Converts a date, datetime or ISO 8601 string to epoch milliseconds, as
+    Elasticsearch stores dates"""
+    if isinstance(value, six.string_types):
+        value = parse_datetime(value) or parse_date(value)
+    if isinstance(value, datetime):
+        if value.utcoffset() is not None:
+            value = value - value.utcoffset()
+        return timegm(value.timetuple()) * 1000 + value.microsecond // 1000
+    if isinstance(value, date):
+        return timegm(value.timetuple()) * 1000
+    return value
+
+
+def field_type(mapping, path):
+    """Returns the mapping type of the dotted field path, or None"""
+    config = mapping
+    for part in path.split('.'):
+        config = config.get('properties', {}).get(part)
+        if config is None:
+            return None
+    return config.get('type')
+
+
+def field_values(doc, path):
+    """Returns the values at the dotted path of doc, arrays flattened"""
+    values = [doc]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if not isinstance(value, dict):
+                continue
+            value = value.get(part)
+            if isinstance(value, list):
+                found.extend(value)
+            elif value is not None:
+                found.append(value)
+        values = found
+    return values
+
+
+def split_boost(field):
+    name, _, boost = field.partition('^')
+    return name, float(boost) if boost else 1.0
+
+
+class DocumentType(object):
+    """The documents of one es_type_name and their mapping"""
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.docs = {}
+        # {document id: {field: analyzed tokens}}, filled as queries need them
+        self._tokens = {}
+
+    def put(self, doc_id, source):
+        self.docs[doc_id] = source
+        self._tokens.pop(doc_id, None)
+
+    def remove(self, doc_id):
+        del self.docs[doc_id]
+        self._tokens.pop(doc_id, None)
+
+    def values(self, doc_id, path):
+        """Returns the comparable values of path: dates as epoch milliseconds,
+        analyzed strings as their tokens"""
+        kind = field_type(self.mapping, path)
+        values = field_values(self.docs[doc_id], path)
+        if kind == 'date':
+            return [to_millis(v) for v in values]
+        if kind == 'string' and self.isAnalyzed(path):
+            return sorted(self.tokens(doc_id, path))
+        return values
+
+    def isAnalyzed(self, path):
+        config = self.mapping
+        for part in path.split('.'):
+            config = config['properties'][part]
+        return config.get('index', 'analyzed') == 'analyzed'
+
+    def tokens(self, doc_id, path):
+        cached = self._tokens.setdefault(doc_id, {})
+        tokens = cached.get(path)
+        if tokens is None:
+            tokens = cached[path] = set()
+            for value in field_values(self.docs[doc_id], path):
+                tokens.update(analyze(value))
+        return tokens
+
+    def normalize(self, path, value):
+        """Converts a query value to the form values() returns for path"""
+        kind = field_type(self.mapping, path)
+        if kind == 'date':
+            return to_millis(value)
+        if kind == 'string' and self.isAnalyzed(path):
+            return value.lower()
+        return value
+
+
+class QueryEvaluator(object):
+    """Scores a document against a query. score() returns None when the
+    document does not match."""
+
+    def __init__(self, docType):
+        self.docType = docType
+
+    def score(self, query, doc_id):
+        (kind, args), = query.items()
+        method = getattr(self, 'query_%s' % kind, None)
+        if method is None:
+            raise ValueError('Unsupported query: %s' % kind)
+        return method(args, doc_id)
+
+    def query_match_all(self, args, doc_id):
+        return 1.0
+
+    def query_term(self, args, doc_id):
+        (path, value), = args.items()
+        if isinstance(value, dict):
+            value = value['value']
+        return 1.0 if self.docType.normalize(path, value) in self.docType.values(doc_id, path) else None
+
+    def query_terms(self, args, doc_id):
+        (path, values), = args.items()
+        wanted = set(self.docType.normalize(path, v) for v in values)
+        return 1.0 if wanted.intersection(self.docType.values(doc_id, path)) else None
+
+    def query_range(self, args, doc_id):
+        (path, bounds), = args.items()
+        bounds = dict((op, self.docType.normalize(path, v)) for op, v in bounds.items()
+                      if op in ('gt', 'gte', 'lt', 'lte'))
+        for value in self.docType.values(doc_id, path):
+            if (('gt' not in bounds or value > bounds['gt']) and
+                    ('gte' not in bounds or value >= bounds['gte']) and
+                    ('lt' not in bounds or value < bounds['lt']) and
+                    ('lte' not in bounds or value <= bounds['lte'])):
+                return 1.0
+        return None
+
+    def query_bool(self, args, doc_id):
+        def clauses(key):
+            value = args.get(key, [])
+            return value if isinstance(value, list) else [value]
+        total = 0.0
+        for query in clauses('must'):
+            score = self.score(query, doc_id)
+            if score is None:
+                return None
+            total += score
+        for query in clauses('filter'):
+            if self.score(query, doc_id) is None:
+                return None
+        for query in clauses('must_not'):
+            if self.score(query, doc_id) is not None:
+                return None
+        should = clauses('should')
+        if should:
+            required = args.get('minimum_should_match',
+                                0 if args.get('must') or args.get('filter') else 1)
+            matched = 0
+            for query in should:
+                score = self.score(query, doc_id)
+                if score is not None:
+                    matched += 1
+                    total += score
+            if matched < int(required):
+                return None
+        return total
+
+    def query_match(self, args, doc_id):
+        (path, text), = args.items()
+        if isinstance(text, dict):
+            text = text['query']
+        return self.query_multi_match({'query': text, 'fields': [path]}, doc_id)
+
+    def query_multi_match(self, args, doc_id):
+        terms = set(analyze(args['query']))
+        scores = []
+        for field in args['fields']:
+            path, boost = split_boost(field)
+            matched = terms.intersection(self.docType.tokens(doc_id, path))
+            if matched:
+                scores.append(boost * len(matched))
+        if not scores:
+            return None
+        best = max(scores)
+        return best + args.get('tie_breaker', 0.0) * (sum(scores) - best)
+
+
+def query_terms(query):
+    """Returns the analyzed terms of the text queries in query, for highlighting"""
+    terms = set()
+    if isinstance(query, dict):
+        for kind, args in query.items():
+            if kind == 'multi_match':
+                terms.update(analyze(args['query']))
+            elif kind == 'match':
+                text = list(args.values())[0]
+                terms.update(analyze(text['query'] if isinstance(text, dict) else text))
+            else:
+                terms.update(query_terms(args))
+    elif isinstance(query, list):
+        for clause in query:
+            terms.update(query_terms(clause))
+    return terms
+
+
+def highlight(value, terms, pre, post):
+    """Wraps the tokens of value found in terms with pre and post"""
+    return TOKEN.sub(lambda m: pre + m.group(0) + post if m.group(0).lower() in terms else m.group(0),
+                     value)
+
+
+def select_source(doc, paths):
+    """Returns the parts of doc listed in the dotted paths"""
+    selected = {}
+    for path in paths:
+        parts = path.split('.')
+        value = doc
+        for part in parts:
+            value = value.get(part) if isinstance(value, dict) else None
+        if value is None:
+            continue
+        target = selected
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return selected
+
+
+class MemorySearchBackend(object):
+    name = 'memory'
+
+    def __init__(self, sync=True):
+        self.sync = sync
+        self._types = {}
+        self._completions = None
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def docType(self, name):
+        docType = self._types.get(name)
+        if docType is None:
+            mapping = indexing.get_model_for_type(name)._meta.es_mapping
+            docType = self._types[name] = DocumentType(mapping)
+        return docType
+
+    def bulk_actions(self, actions):
+        """Applies bulk index and delete actions, as built by
+        indexing.iter_es_actions(). Returns (number applied, errors) like the
+        Elasticsearch bulk helper."""
+        success, errors = 0, []
+        with self._lock:
+            for action in actions:
+                op = action.get('_op_type', 'index')
+                docType = self.docType(action['_type'])
+                doc_id = str(action['_id'])
+                if op == 'delete':
+                    if doc_id not in docType.docs:
+                        errors.append({'delete': {'_id': doc_id, 'status': 404}})
+                        continue
+                    docType.remove(doc_id)
+                else:
+                    docType.put(doc_id, dict((k, v) for k, v in action.items() if k not in ACTION_KEYS))
+                if action['_type'] == 'topicnode':
+                    self._completions = None
+                success += 1
+        return success, errors
+
+    def clear(self):
+        with self._lock:
+            self._types = {}
+            self._completions = None
+
+    def load(self):
+        """Replaces the index with every row of the indexed models"""
+        with self._lock:
+            self.clear()
+            for model in indexing.get_indexed_models():
+                self.bulk_actions(indexing.iter_es_actions(model._default_manager.all()))
+            self._loaded = True
+
+    def refresh(self):
+        """Brings the index up to date with the database, if syncing"""
+        if not self.sync:
+            return
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            while indexing.sync_outbox(self):
+                pass
+
+    def completions(self):
+        """Sorted (lowercase input, pk, input) entries of every name_complete input"""
+        if self._completions is None:
+            entries = []
+            for source in self.docType('topicnode').docs.values():
+                complete = source.get('name_complete') or {}
+                for text in complete.get('input', []):
+                    entries.append((text.lower(), complete['payload']['pk'], text))
+            self._completions = sorted(entries)
+        return self._completions
+
+    def suggest(self, term):
+        self.refresh()
+        prefix = term.lower()
+        with self._lock:
+            entries = self.completions()
+            options = []
+            seen = set()
+            for key, pk, text in entries[bisect_left(entries, (prefix,)):]:
+                if not key.startswith(prefix) or len(options) == SUGGEST_SIZE:
+                    break
+                if pk not in seen:
+                    seen.add(pk)
+                    options.append({'id': pk, 'value': text})
+        return options
+
+    def search(self, params):
+        body = build_list_query(params)
+        self.refresh()
+        resp = self.run('list', body)
+        lists, nextCursor = parse_hits(resp, body)
+        return {
+            'lists': lists,
+            'total': resp['hits']['total'],
+            'next': nextCursor,
+        }
+
+    def run(self, doc_type, body):
+        """Executes a search body against doc_type. Returns a response shaped
+        like the one Elasticsearch sends."""
+        with self._lock:
+            docType = self.docType(doc_type)
+            evaluator = QueryEvaluator(docType)
+            query = body.get('query', {'match_all': {}})
+            sort = []
+            for spec in body.get('sort', ['_score']):
+                (path, options), = (spec if isinstance(spec, dict) else {spec: {}}).items()
+                sort.append((path, options.get('order', 'desc' if path == '_score' else 'asc')))
+            scored = any(path == '_score' for path, order in sort)
+            hits = []
+            for doc_id in docType.docs:
+                score = evaluator.score(query, doc_id)
+                if score is None:
+                    continue
+                sortValues = []
+                for path, order in sort:
+                    if path == '_score':
+                        sortValues.append(score)
+                    else:
+                        values = docType.values(doc_id, path)
+                        sortValues.append(values[0] if values else None)
+                hits.append((sortValues, doc_id, score))
+            orders = [order for path, order in sort]
+            # stable sorts from the last key to the first; missing values go last
+            for i, order in reversed(list(enumerate(orders))):
+                present = [hit for hit in hits if hit[0][i] is not None]
+                present.sort(key=lambda hit: hit[0][i], reverse=order == 'desc')
+                hits = present + [hit for hit in hits if hit[0][i] is None]
+            total = len(hits)
+            if 'search_after' in body:
+                hits = [hit for hit in hits if self.isAfter(hit[0], body['search_after'], orders)]
+            start = body.get('from', 0)
+            page = hits[start:start + body.get('size', 10)]
+            return {'hits': {'total': total, 'hits': [
+                self.hit(docType, doc_id, score if scored else None, sortValues, body, query)
+                for sortValues, doc_id, score in page]}}
+
+    def isAfter(self, values, after, orders):
+        for value, bound, order in zip(values, after, orders):
+            if value == bound:
+                continue
+            if value is None or bound is None:
+                return bound is not None
+            return value > bound if order == 'asc' else value < bound
+        return False
+
+    def hit(self, docType, doc_id, score, sortValues, body, query):
+        source = docType.docs[doc_id]
+        hit = {
+            '_id': doc_id,
+            '_score': score,
+            '_source': select_source(source, body['_source']) if '_source' in body else source,
+            'sort': sortValues,
+        }
+        if 'highlight' in body:
+            terms = query_terms(query)
+            options = body['highlight']
+            fragments = {}
+            for path, config in options['fields'].items():
+                marked = []
+                for value in field_values(source, path):
+                    text = highlight(value, terms, options['pre_tags'][0], options['post_tags'][0])
+                    if text != value:
+                        marked.append(text)
+                if marked:
+                    fragments[path] = marked[:config.get('number_of_fragments') or 1]
+            if fragments:
+                hit['highlight'] = fragments
+        return hit
@@ -0,0 +1,217 @@
+"""Per-view request metrics.
+
+RequestMetricsMiddleware records, for every request, its wall time, the
+number and duration of the database queries and Elasticsearch calls it made
+and the size of its response. They are aggregated per URL name (for example
+'listapp:list-items') into histograms in this process, which MetricsView
+serves in the Prometheus text format. With METRICS_LOG each request is also
+logged as a single line to the 'lists.metrics' logger.
+
+settings.VIEW_QUERY_BUDGETS caps the queries a view may run. A request over
+its budget is logged as a warning, or raises QueryBudgetExceeded when
+METRICS_ENFORCE_BUDGETS is set, which the tests do to catch N+1 regressions.
+The follow-up chunk queries of a stream (see lists.db.iter_keyset) scale
+with the rows sent by design; they are counted in db_queries but not
+charged to the budget.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db.backends import utils as db_utils
+from elasticsearch import Transport
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS = (
+    ('wall_seconds', LATENCY_BUCKETS),
+    ('db_queries', (0, 1, 2, 3, 5, 10, 20, 50, 100)),
+    ('db_seconds', LATENCY_BUCKETS),
+    ('es_calls', (0, 1, 2, 5, 10)),
+    ('es_seconds', LATENCY_BUCKETS),
+    ('response_bytes', (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Histogram(object):
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # counts[i] holds the observations in (bounds[i - 1], bounds[i]],
+        # the last one those above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Yields (upper bound, observations <= bound) pairs, ending with '+Inf'"""
+        total = 0
+        for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry(object):
+    def __init__(self):
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view, values):
+        with self._lock:
+            histograms = self._views.get(view)
+            if histograms is None:
+                histograms = self._views[view] = dict(
+                    (name, Histogram(bounds)) for name, bounds in BUCKETS)
+            for name, value in values.items():
+                histograms[name].observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def render(self):
+        """Returns every histogram in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, bounds in BUCKETS:
+                metric = 'lists_request_%s' % name
+                lines.append('# TYPE %s histogram' % metric)
+                for view in sorted(self._views):
+                    histogram = self._views[view][name]
+                    for bound, count in histogram.cumulative():
+                        lines.append('%s_bucket{view="%s",le="%s"} %d' % (metric, view, bound, count))
+                    lines.append('%s_sum{view="%s"} %s' % (metric, view, histogram.sum))
+                    lines.append('%s_count{view="%s"} %d' % (metric, view, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class RequestStats(object):
+    def __init__(self):
+        self.start = time.time()
+        self.dbQueries = 0
+        self.dbTime = 0.0
+        # queries of dbQueries that read further chunks of a stream
+        self.streamQueries = 0
+        self.esCalls = 0
+        self.esTime = 0.0
+
+
+_local = threading.local()
+
+
+def current_stats():
+    """The RequestStats of the request this thread is serving, if any"""
+    return getattr(_local, 'stats', None)
+
+
+def count_stream_query():
+    """Marks the next query of this request as a further chunk of a stream"""
+    stats = current_stats()
+    if stats is not None:
+        stats.streamQueries += 1
+
+
+def _timed(method, counter, timer):
+    def wrapper(self, *args, **kwargs):
+        stats = current_stats()
+        if stats is None:
+            return method(self, *args, **kwargs)
+        start = time.time()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            setattr(stats, counter, getattr(stats, counter) + 1)
+            setattr(stats, timer, getattr(stats, timer) + time.time() - start)
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_db():
+    """Counts the queries run through Django cursors. Django 1.9 has no
+    connection.execute_wrapper(), so this wraps CursorWrapper.execute and
+    executemany, once per process."""
+    cursor_class = db_utils.CursorWrapper
+    if getattr(cursor_class.execute, 'instrumented', False):
+        return
+    cursor_class.execute = _timed(cursor_class.execute, 'dbQueries', 'dbTime')
+    cursor_class.executemany = _timed(cursor_class.executemany, 'dbQueries', 'dbTime')
+
+
+class InstrumentedTransport(Transport):
+    """Counts the Elasticsearch calls of the current request; a call that
+    was retried counts once, with the time of all its attempts"""
+    perform_request = _timed(Transport.perform_request, 'esCalls', 'esTime')
+
+
+def check_budget(view, queries):
+    budget = settings.VIEW_QUERY_BUDGETS.get(view)
+    if budget is None or queries <= budget:
+        return
+    message = '%s ran %d queries, over its budget of %d' % (view, queries, budget)
+    if settings.METRICS_ENFORCE_BUDGETS:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+class RequestMetricsMiddleware(object):
+    """Records the metrics of every request. List it first in
+    MIDDLEWARE_CLASSES so the wall time covers the other middleware."""
+
+    def process_request(self, request):
+        _local.stats = RequestStats()
+
+    def process_response(self, request, response):
+        stats = current_stats()
+        if stats is None:
+            return response
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else 'unresolved'
+        if response.streaming:
+            # the rows are read while the response is sent
+            response.streaming_content = self.measure_stream(
+                response.streaming_content, view, stats, response.status_code)
+        else:
+            self.finish(view, stats, len(response.content), response.status_code)
+        return response
+
+    def measure_stream(self, content, view, stats, status_code):
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.finish(view, stats, size, status_code)
+
+    def finish(self, view, stats, size, status_code):
+        if current_stats() is stats:
+            _local.stats = None
+        wall = time.time() - stats.start
+        registry.observe(view, {
+            'wall_seconds': wall,
+            'db_queries': stats.dbQueries,
+            'db_seconds': stats.dbTime,
+            'es_calls': stats.esCalls,
+            'es_seconds': stats.esTime,
+            'response_bytes': size,
+        })
+        if settings.METRICS_LOG:
+            logger.info('view=%s status=%d wall_ms=%.1f db_queries=%d db_ms=%.1f '
+                        'es_calls=%d es_ms=%.1f bytes=%d',
+                        view, status_code, wall * 1000, stats.dbQueries, stats.dbTime * 1000,
+                        stats.esCalls, stats.esTime * 1000, size)
+        check_budget(view, stats.dbQueries - stats.streamQueries)
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 16:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('docType', models.CharField(max_length=30)),
+                ('objectId', models.PositiveIntegerField()),
+                ('dateCreated', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 16:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0002_searchoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.IntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_set', to='lists.TopicNode')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_set', to='lists.TopicNode')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='topicclosure',
+            unique_together=set([('ancestor', 'descendant')]),
+        ),
+        # backfill from the existing edges
+        migrations.RunSQL(
+            """
+            WITH RECURSIVE walk(ancestor_id, descendant_id, depth) AS (
+                SELECT parent_id, child_id, 1 FROM lists_topicedge
+                UNION
+                SELECT w.ancestor_id, e.child_id, w.depth + 1
+                    FROM walk w INNER JOIN lists_topicedge e ON e.parent_id = w.descendant_id
+            )
+            INSERT INTO lists_topicclosure (ancestor_id, descendant_id, depth)
+                SELECT ancestor_id, descendant_id, MIN(depth) FROM walk
+                    GROUP BY ancestor_id, descendant_id
+            """,
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 16:39
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0004_versionstamp'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='listitem',
+            index_together=set([('list', '_order')]),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 16:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0005_listitem_order_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicListStats',
+            fields=[
+                ('topic', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listStats', serialize=False, to='lists.TopicNode')),
+                ('directCount', models.IntegerField(default=0)),
+                ('subtreeCount', models.IntegerField(default=0)),
+                ('lastModified', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        # backfill the counts of the existing lists
+        migrations.RunSQL(
+            """
+            INSERT INTO lists_topicliststats (topic_id, "directCount", "subtreeCount")
+                SELECT n.id, 0, 0 FROM lists_topicnode n;
+            WITH counted AS (
+                SELECT topic_id, "dateModified" FROM lists_list
+                    WHERE active AND status = 'PUBLISHED' AND topic_id IS NOT NULL
+            ), direct AS (
+                SELECT topic_id, COUNT(*) AS n, MAX("dateModified") AS modified
+                    FROM counted GROUP BY topic_id
+            ), subtree AS (
+                SELECT topic_id, COUNT(*) AS n, MAX(modified) AS modified FROM (
+                    SELECT topic_id, "dateModified" AS modified FROM counted
+                    UNION ALL
+                    SELECT cl.ancestor_id, c."dateModified"
+                        FROM counted c INNER JOIN lists_topicclosure cl ON cl.descendant_id = c.topic_id
+                ) under GROUP BY topic_id
+            )
+            UPDATE lists_topicliststats s
+                SET "directCount" = COALESCE(direct.n, 0),
+                    "subtreeCount" = COALESCE(subtree.n, 0),
+                    "lastModified" = subtree.modified
+                FROM lists_topicnode n
+                    LEFT JOIN direct ON direct.topic_id = n.id
+                    LEFT JOIN subtree ON subtree.topic_id = n.id
+                WHERE s.topic_id = n.id;
+            """,
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def create_prefix_index(apps, schema_editor):
+    # trigram indexes need the pg_trgm contrib extension; where it cannot be
+    # installed a text_pattern_ops index still serves the prefix LIKE queries
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        available = cursor.fetchone() is not None
+    if available:
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX lists_topicnode_name_trgm ON lists_topicnode '
+            'USING gin (lower(name) gin_trgm_ops)')
+    else:
+        schema_editor.execute(
+            'CREATE INDEX lists_topicnode_name_prefix ON lists_topicnode '
+            '(lower(name) text_pattern_ops)')
+
+
+def drop_prefix_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS lists_topicnode_name_trgm')
+    schema_editor.execute('DROP INDEX IF EXISTS lists_topicnode_name_prefix')
+
+
+class Migration(migrations.Migration):
+    """Full-text search columns for the PostgreSQL search backend. The
+    search_vector columns are maintained by triggers and are not model fields."""
+
+    dependencies = [
+        ('lists', '0006_topicliststats'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            ALTER TABLE lists_list ADD COLUMN search_vector tsvector;
+            ALTER TABLE lists_listitem ADD COLUMN search_vector tsvector;
+
+            CREATE FUNCTION lists_list_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector :=
+                    setweight(to_tsvector('pg_catalog.english', coalesce(NEW.title, '')), 'A') ||
+                    setweight(to_tsvector('pg_catalog.english', coalesce(NEW.description, '')), 'B');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE FUNCTION lists_listitem_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector :=
+                    setweight(to_tsvector('pg_catalog.english', coalesce(NEW.title, '')), 'A') ||
+                    setweight(to_tsvector('pg_catalog.english', coalesce(NEW.description, '')), 'B') ||
+                    setweight(to_tsvector('pg_catalog.english', coalesce(NEW."deepDive", '')), 'C');
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql;
+
+            -- only fire when the text changes, not on _order or flag updates
+            CREATE TRIGGER lists_list_search_vector
+                BEFORE INSERT OR UPDATE OF title, description ON lists_list
+                FOR EACH ROW EXECUTE PROCEDURE lists_list_search_vector_update();
+            CREATE TRIGGER lists_listitem_search_vector
+                BEFORE INSERT OR UPDATE OF title, description, "deepDive" ON lists_listitem
+                FOR EACH ROW EXECUTE PROCEDURE lists_listitem_search_vector_update();
+
+            UPDATE lists_list SET title = title;
+            UPDATE lists_listitem SET title = title;
+
+            CREATE INDEX lists_list_search_vector ON lists_list USING gin (search_vector);
+            CREATE INDEX lists_listitem_search_vector ON lists_listitem USING gin (search_vector);
+            """,
+            """
+            DROP TRIGGER lists_listitem_search_vector ON lists_listitem;
+            DROP TRIGGER lists_list_search_vector ON lists_list;
+            DROP FUNCTION lists_listitem_search_vector_update();
+            DROP FUNCTION lists_list_search_vector_update();
+            ALTER TABLE lists_listitem DROP COLUMN search_vector;
+            ALTER TABLE lists_list DROP COLUMN search_vector;
+            """
+        ),
+        migrations.RunPython(create_prefix_index, drop_prefix_index),
+    ]
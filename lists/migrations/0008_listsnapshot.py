@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 16:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0007_search_vectors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListSnapshot',
+            fields=[
+                ('list', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='lists.List')),
+                ('data', models.TextField()),
+                ('lastModified', models.DateTimeField()),
+                ('dateCreated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
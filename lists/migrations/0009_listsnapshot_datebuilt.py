@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 21:40
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0008_listsnapshot'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='listsnapshot',
+            old_name='dateCreated',
+            new_name='dateBuilt',
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Lets the PostgreSQL search backend browse lists newest first, and
+    resume from a cursor, with an index scan instead of a sort. The date
+    expression must stay identical to search.PG_SORT_DATE."""
+
+    dependencies = [
+        ('lists', '0009_listsnapshot_datebuilt'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE INDEX lists_list_browse ON lists_list (status, active,
+                ((EXTRACT(EPOCH FROM date_trunc('milliseconds', "dateCreated" AT TIME ZONE 'UTC')) * 1000)::bigint) DESC,
+                id DESC);
+            """,
+            "DROP INDEX lists_list_browse;"
+        ),
+    ]
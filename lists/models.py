@@ -75,45 +75,154 @@ class TopicNode(models.Model):
         return {"input": [self.name], 'payload': {"pk": self.pk}}
 
 class TopicEdgeManager(models.Manager):
+    # The structural checks below are answered from the worker's in-memory
+    # TopicGraph snapshot (see topicgraph.py) without touching the database.
     def isParent(self, topic_id):
-        qset = super(TopicEdgeManager, self).get_queryset().filter(parent=topic_id)
-        return qset.exists()
+        from .topicgraph import get_topic_graph
+        return get_topic_graph().isParent(topic_id)
 
     def isChild(self, topic_id):
-        qset = super(TopicEdgeManager, self).get_queryset().filter(child=topic_id)
-        return qset.exists()
+        from .topicgraph import get_topic_graph
+        return get_topic_graph().isChild(topic_id)
 
     def isLeaf(self, topic_id):
-        return self.isChild(topic_id) and not self.isParent(topic_id)
+        from .topicgraph import get_topic_graph
+        return get_topic_graph().isLeaf(topic_id)
 
     def isRoot(self, topic_id):
-        return self.isParent(topic_id) and not self.isChild(topic_id)
+        from .topicgraph import get_topic_graph
+        return get_topic_graph().isRoot(topic_id)
 
     def getDescendants(self, topic_id):
-        """Calls database stored function"""
+        """Returns the descendants of topic_id ordered by their shortest distance (level) from it"""
+        qset = TopicClosure.objects.filter(ancestor=topic_id).order_by('depth', 'descendant__name')
+        return [{'level': level, 'id': pk, 'name': name}
+                for level, pk, name in qset.values_list('depth', 'descendant_id', 'descendant__name')]
+
+    def getDescendantPaths(self, topic_id):
+        """Calls database stored function. Lists every path to every descendant, depth-first"""
         from django.db import connection
-        cursor = connection.cursor()
-        cursor.execute("SELECT level, id, name, path FROM get_topic_descendants(%s)", [topic_id])
-        results = []
-        for row in cursor.fetchall():
-            results.append({'level': row[0], 'id': row[1], 'name': row[2], 'path': row[3]})
-        return results
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT level, id, name, path FROM get_topic_descendants(%s)", [topic_id])
+            results = []
+            for row in cursor.fetchall():
+                results.append({'level': row[0], 'id': row[1], 'name': row[2], 'path': row[3]})
+            return results
 
     def getDescendantIdsOnly(self, topic_id):
-        """Calls database stored function"""
-        from django.db import connection
-        cursor = connection.cursor()
-        cursor.execute("SELECT DISTINCT id FROM get_topic_descendants(%s)", [topic_id])
-        results = [row[0] for row in cursor.fetchall()]
-        return results
+        qset = TopicClosure.objects.filter(ancestor=topic_id)
+        return list(qset.values_list('descendant_id', flat=True))
 
     def isAncestorOf(self, ancestor_id, child_id):
-        """Calls database stored function"""
-        from django.db import connection
-        cursor = connection.cursor()
-        cursor.execute("SELECT id FROM get_topic_descendants_until(%s,%s)", [ancestor_id, child_id])
-        cursor.fetchall() # cursor.rowcount is updated after the fetch
-        return cursor.rowcount == 0
+        return TopicClosure.objects.filter(ancestor=ancestor_id, descendant=child_id).exists()
+
+    def wouldCreateCycle(self, parent_id, child_id):
+        """True if a parent -> child edge would close a cycle, i.e. child
+        already reaches parent. A single indexed closure lookup."""
+        return parent_id == child_id or self.isAncestorOf(child_id, parent_id)
+
+    def bulkImport(self, edges):
+        """Validates and inserts many new TopicEdge instances at once.
+
+        Instead of checking every edge against the closure table, the new
+        edges are merged with the existing ones and checked with a single
+        topological sort. The closure table is then rebuilt once. Raises
+        ValidationError, inserting nothing, if the result would have a cycle.
+        """
+        from django.db import transaction
+        from .topicgraph import topic_edges_changed
+        edges = list(edges)
+        with transaction.atomic():
+            TopicClosure.objects.lockTable()
+            existing = set(self.values_list('parent_id', 'child_id'))
+            new = []
+            for edge in edges:
+                ends = (edge.parent_id, edge.child_id)
+                if ends[0] == ends[1]:
+                    raise ValidationError(
+                        _('A topic node may not be connected to itself (%(id)s).'),
+                        params={'id': ends[0]})
+                if ends not in existing:
+                    existing.add(ends)
+                    new.append(edge)
+            cycle = findCycleNodes(existing)
+            if cycle:
+                raise ValidationError(
+                    _('These edges would create a cycle through topics %(ids)s.'),
+                    params={'ids': ', '.join(str(pk) for pk in sorted(cycle))})
+            created = self.bulk_create(new)
+            TopicClosure.objects.rebuild()
+            TopicListStats.objects.recompute()
+            topic_edges_changed()
+        return created
+
+
+def findCycleNodes(edges):
+    """Returns the set of nodes that lie on a cycle of the (parent, child)
+    pairs in edges, which is empty when the graph is acyclic.
+
+    A topological sort (Kahn's algorithm) first removes every node that no
+    cycle leads into; the nodes it cannot sort are then split into strongly
+    connected components, and only the components that form a cycle are kept,
+    not the nodes merely downstream of one.
+    """
+    children = {}
+    indegree = {}
+    for parent, child in edges:
+        children.setdefault(parent, []).append(child)
+        indegree.setdefault(parent, 0)
+        indegree[child] = indegree.get(child, 0) + 1
+    ready = [node for node, degree in indegree.items() if degree == 0]
+    while ready:
+        node = ready.pop()
+        del indegree[node]
+        for child in children.get(node, ()):
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+    remaining = set(indegree)
+    if not remaining:
+        return remaining
+    # Kosaraju: order the remaining nodes by DFS finish time, then collect
+    # components along the reversed edges in reverse finish order
+    parents = {}
+    for parent, child in edges:
+        if parent in remaining and child in remaining:
+            parents.setdefault(child, []).append(parent)
+    finished = []
+    visited = set()
+    for start in remaining:
+        if start in visited:
+            continue
+        visited.add(start)
+        stack = [(start, iter(children.get(start, ())))]
+        while stack:
+            node, pending = stack[-1]
+            for child in pending:
+                if child in remaining and child not in visited:
+                    visited.add(child)
+                    stack.append((child, iter(children.get(child, ()))))
+                    break
+            else:
+                stack.pop()
+                finished.append(node)
+    onCycle = set()
+    assigned = set()
+    for start in reversed(finished):
+        if start in assigned:
+            continue
+        component = [start]
+        assigned.add(start)
+        i = 0
+        while i < len(component):
+            for parent in parents.get(component[i], ()):
+                if parent not in assigned:
+                    assigned.add(parent)
+                    component.append(parent)
+            i += 1
+        if len(component) > 1 or start in children.get(start, ()):
+            onCycle.update(component)
+    return onCycle
 
 @python_2_unicode_compatible
 class TopicEdge(models.Model):
@@ -135,7 +244,258 @@ class TopicEdge(models.Model):
         if self.parent.pk == self.child.pk:
             raise ValidationError({
                 'child': _('A topic node may not be connected to itself.')})
+        if TopicEdge.objects.wouldCreateCycle(self.parent.pk, self.child.pk):
+            raise ValidationError({
+                'child': _('This connection would create a cycle of topics.')})
+
+    def save(self, *args, **kwargs):
+        """Writes the edge and updates the closure table in one transaction,
+        under the closure table lock. Raises ValidationError, writing nothing,
+        if the edge would close a cycle."""
+        from django.db import transaction
+        from .topicgraph import topic_edges_changed
+        ends = (self.parent_id, self.child_id)
+        with transaction.atomic():
+            TopicClosure.objects.lockTable()
+            previous = None
+            if self.pk:
+                previous = TopicEdge.objects.filter(pk=self.pk).values_list(
+                    'parent_id', 'child_id').first()
+            if previous == ends:
+                super(TopicEdge, self).save(*args, **kwargs)
+                return
+            if previous:
+                # the closure without the old edge, to check the new one against
+                removed = TopicClosure.objects.removeEdge(*previous, excluding=self.pk)
+                TopicListStats.objects.applyPaths(removed, -1)
+            if TopicEdge.objects.wouldCreateCycle(*ends):
+                raise ValidationError({
+                    'child': _('This connection would create a cycle of topics.')})
+            super(TopicEdge, self).save(*args, **kwargs)
+            TopicListStats.objects.applyPaths(TopicClosure.objects.addEdge(*ends), 1)
+            topic_edges_changed()
+
+    def delete(self, *args, **kwargs):
+        # take the closure lock before the row lock, in the same order as
+        # save(); the post_delete handler then removes the edge's paths
+        from django.db import transaction
+        with transaction.atomic():
+            TopicClosure.objects.lockTable()
+            return super(TopicEdge, self).delete(*args, **kwargs)
+
+
+class TopicClosureManager(models.Manager):
+    """Keeps the closure table consistent with TopicEdge. Called from the
+    TopicEdge signal handlers; each method is a few set-based statements."""
+
+    def lockTable(self):
+        """Serializes closure writers so concurrent edge changes can't interleave.
+        Must be called inside a transaction."""
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute("LOCK TABLE lists_topicclosure IN SHARE ROW EXCLUSIVE MODE")
+
+    def addEdge(self, parent_id, child_id):
+        """Adds the paths created by a new parent -> child edge.
+
+        Raises ValidationError if the edge would close a cycle. TopicEdge.save()
+        calls it in the transaction that writes the edge, after checking the
+        same under the table lock. Returns the (ancestor, descendant) pairs
+        that were not connected before.
+        """
+        from django.db import connection, transaction
+        with transaction.atomic():
+            self.lockTable()
+            if TopicEdge.objects.wouldCreateCycle(parent_id, child_id):
+                raise ValidationError({
+                    'child': _('This connection would create a cycle of topics.')})
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    WITH a AS (
+                        SELECT ancestor_id, depth FROM lists_topicclosure WHERE descendant_id = %(parent)s
+                        UNION ALL SELECT %(parent)s, 0
+                    ), d AS (
+                        SELECT descendant_id, depth FROM lists_topicclosure WHERE ancestor_id = %(child)s
+                        UNION ALL SELECT %(child)s, 0
+                    ), paths AS (
+                        SELECT a.ancestor_id, d.descendant_id, MIN(a.depth + d.depth + 1) AS depth
+                            FROM a CROSS JOIN d
+                            GROUP BY a.ancestor_id, d.descendant_id
+                    ), shortened AS (
+                        UPDATE lists_topicclosure c SET depth = p.depth
+                            FROM paths p
+                            WHERE c.ancestor_id = p.ancestor_id
+                                AND c.descendant_id = p.descendant_id
+                                AND c.depth > p.depth
+                    )
+                    INSERT INTO lists_topicclosure (ancestor_id, descendant_id, depth)
+                        SELECT p.ancestor_id, p.descendant_id, p.depth FROM paths p
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM lists_topicclosure c
+                                WHERE c.ancestor_id = p.ancestor_id AND c.descendant_id = p.descendant_id
+                        )
+                    RETURNING ancestor_id, descendant_id
+                """, {'parent': parent_id, 'child': child_id})
+                return cursor.fetchall()
+
+    def removeEdge(self, parent_id, child_id, excluding=None):
+        """Recomputes the paths that may have run through a removed parent -> child edge.
 
+        Only pairs of (ancestor of parent, descendant of child) are affected;
+        they are deleted and re-derived from the remaining edges, leaving out
+        the TopicEdge pk excluding, as for an edge whose ends are being changed.
+        Returns the pairs that are no longer connected.
+        """
+        from django.db import connection, transaction
+        with transaction.atomic():
+            self.lockTable()
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT ancestor_id FROM lists_topicclosure WHERE descendant_id = %s",
+                               [parent_id])
+                ancestors = [row[0] for row in cursor.fetchall()] + [parent_id]
+                cursor.execute("SELECT descendant_id FROM lists_topicclosure WHERE ancestor_id = %s",
+                               [child_id])
+                descendants = [row[0] for row in cursor.fetchall()] + [child_id]
+                cursor.execute("""
+                    DELETE FROM lists_topicclosure
+                        WHERE ancestor_id = ANY(%(ancestors)s) AND descendant_id = ANY(%(descendants)s)
+                    RETURNING ancestor_id, descendant_id
+                """, {'ancestors': ancestors, 'descendants': descendants})
+                removed = set(cursor.fetchall())
+                cursor.execute("""
+                    WITH RECURSIVE edges AS (
+                        SELECT parent_id, child_id FROM lists_topicedge
+                            WHERE id IS DISTINCT FROM %(excluding)s
+                    ), walk(ancestor_id, descendant_id, depth) AS (
+                        SELECT parent_id, child_id, 1 FROM edges
+                            WHERE parent_id = ANY(%(ancestors)s)
+                        UNION
+                        SELECT w.ancestor_id, e.child_id, w.depth + 1
+                            FROM walk w INNER JOIN edges e ON e.parent_id = w.descendant_id
+                    )
+                    INSERT INTO lists_topicclosure (ancestor_id, descendant_id, depth)
+                        SELECT ancestor_id, descendant_id, MIN(depth) FROM walk
+                            WHERE descendant_id = ANY(%(descendants)s)
+                            GROUP BY ancestor_id, descendant_id
+                    RETURNING ancestor_id, descendant_id
+                """, {'ancestors': ancestors, 'descendants': descendants, 'excluding': excluding})
+                return sorted(removed.difference(cursor.fetchall()))
+
+    def rebuild(self):
+        """Recomputes the whole closure table from TopicEdge"""
+        from django.db import connection, transaction
+        with transaction.atomic():
+            self.lockTable()
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM lists_topicclosure")
+                cursor.execute(REBUILD_TOPIC_CLOSURE_SQL)
+
+
+REBUILD_TOPIC_CLOSURE_SQL = """
+    WITH RECURSIVE walk(ancestor_id, descendant_id, depth) AS (
+        SELECT parent_id, child_id, 1 FROM lists_topicedge
+        UNION
+        SELECT w.ancestor_id, e.child_id, w.depth + 1
+            FROM walk w INNER JOIN lists_topicedge e ON e.parent_id = w.descendant_id
+    )
+    INSERT INTO lists_topicclosure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM walk
+            GROUP BY ancestor_id, descendant_id
+"""
+
+# TopicClosure - the transitive closure of the TopicEdge DAG: one row for every
+#                (ancestor, descendant) pair connected by a path. Maintained by
+#                the TopicEdge signal handlers so that ancestry questions are
+#                single indexed lookups instead of recursive walks.
+#   - ancestor: the TopicNode ID at the start of the path
+#   - descendant: the TopicNode ID at the end of the path
+#   - depth: the length of the shortest path between them (1 for a direct child)
+class TopicClosure(models.Model):
+    ancestor = models.ForeignKey(TopicNode,
+        on_delete=models.CASCADE,
+        related_name='descendant_set'
+    )
+    descendant = models.ForeignKey(TopicNode,
+        on_delete=models.CASCADE,
+        db_index=True,
+        related_name='ancestor_set'
+    )
+    depth = models.IntegerField()
+    objects = TopicClosureManager()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+
+class ListManager(models.Manager):
+    def forIndexing(self, queryset=None):
+        """Loads everything es_repr() touches in a constant number of queries:
+        one for the lists joined with topic, creator and lockUser, and one for
+        the active items of all of them."""
+        if queryset is None:
+            queryset = self.get_queryset()
+        return queryset.select_related('topic', 'creator', 'lockUser').prefetch_related(
+            models.Prefetch('listitem_set',
+                queryset=ListItem.objects.filter(active=True),
+                to_attr='activeListItems'
+            )
+        )
+
+    def cloneMany(self, list_ids, user=None):
+        """Clones lists and their active items with set-based INSERT ... SELECT
+        statements, in one transaction and a constant number of queries.
+
+        Each clone is a DRAFT linked to its original through parentList, with
+        version + 1. If user is given, it becomes the creator of the clones
+        and is credited with a Contribution on each. Returns a dict mapping
+        original list ids to clone ids.
+        """
+        from django.db import connection, transaction
+        list_ids = list(list_ids)
+        if not list_ids:
+            return {}
+        now = timezone.now()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO lists_list (title, description, topic_id, active, status,
+                            creator_id, "lockUser_id", "parentList_id", version,
+                            "dateCreated", "dateModified")
+                        SELECT title, description, topic_id, active, %(status)s,
+                                COALESCE(%(user)s, creator_id), NULL, id, version + 1,
+                                %(now)s, %(now)s
+                            FROM lists_list
+                            WHERE id = ANY(%(ids)s::integer[])
+                            ORDER BY id
+                        RETURNING "parentList_id", id
+                """, {'status': List.DRAFT, 'user': user.pk if user else None,
+                      'now': now, 'ids': list_ids})
+                clones = dict(cursor.fetchall())
+                if not clones:
+                    return clones
+                originals, copies = list(clones.keys()), list(clones.values())
+                cursor.execute("""
+                    INSERT INTO lists_listitem (title, description, "deepDive", active, list_id,
+                            "dateCreated", "dateModified", _order)
+                        SELECT i.title, i.description, i."deepDive", i.active, m.new_id,
+                                %(now)s, %(now)s,
+                                row_number() OVER (PARTITION BY i.list_id ORDER BY i._order) - 1
+                            FROM lists_listitem i
+                                INNER JOIN unnest(%(originals)s::integer[], %(copies)s::integer[])
+                                    AS m(old_id, new_id) ON m.old_id = i.list_id
+                            WHERE i.active
+                """, {'now': now, 'originals': originals, 'copies': copies})
+                if user:
+                    cursor.execute("""
+                        INSERT INTO lists_contribution (content_type_id, object_id,
+                                contributor_id, "dateCreated")
+                            SELECT %(content_type)s, new_id, %(user)s, %(now)s
+                                FROM unnest(%(copies)s::integer[]) AS new_id
+                    """, {'content_type': ContentType.objects.get_for_model(List).pk,
+                          'user': user.pk, 'now': now, 'copies': copies})
+            SearchOutbox.objects.bulk_create(
+                [SearchOutbox(docType=List._meta.es_type_name, objectId=pk) for pk in copies])
+        return clones
 
 # List - A list of items.
 #   - title: the visible top-level text describing the list
@@ -205,6 +565,7 @@ class List(models.Model):
     version = models.IntegerField(default=1)
     dateCreated = models.DateTimeField(auto_now_add=True, blank=True)
     dateModified = models.DateTimeField(auto_now=True, blank=True)
+    objects = ListManager()
 
     def __str__(self):
         return self.title
@@ -214,10 +575,12 @@ class List(models.Model):
         es_type_name = 'list'
         es_mapping = {
             'properties': {
+                'id': {'type': 'integer', 'include_in_all': False},
                 'title': {'type': 'string', 'index': 'analyzed'},
                 'description': {'type': 'string', 'index': 'analyzed'},
                 'topic': {'type': 'object',
                           'properties': {
+                              'id': {'type': 'integer', 'include_in_all': False},
                               'name': {'type': 'string', 'index': 'analyzed'},
                               'description': {'type': 'string', 'index': 'analyzed'},
                           }
@@ -265,6 +628,8 @@ class List(models.Model):
         else:
             if config['type'] == 'object':
                 related_object = getattr(self, field_name)
+                if related_object is None:
+                    return None
                 field_es_value = {}
                 field_es_value['_id'] = related_object.pk
                 for prop in config['properties'].keys():
@@ -273,10 +638,229 @@ class List(models.Model):
                 field_es_value = getattr(self, field_name)
         return field_es_value
 
+    def get_es_creator(self):
+        return self.creator.username if self.creator_id else None
+
+    def get_es_lockUser(self):
+        return self.lockUser.username if self.lockUser_id else None
+
+    def get_es_listItems(self):
+        # use the items batched by List.objects.forIndexing() when available
+        activeItems = getattr(self, 'activeListItems', None)
+        if activeItems is None:
+            activeItems = self.listitem_set.filter(active=True)
+        items = []
+        for item in activeItems:
+            items.append({
+                'title': item.title,
+                'description': item.description,
+                'deepdive': item.deepDive,
+                'active': item.active,
+                'datecreated': item.dateCreated,
+                'datemodified': item.dateModified,
+            })
+        return items
+
+    def statsKey(self):
+        """(topic_id, counted) as used by TopicListStats.objects.applyChange()"""
+        return (self.topic_id, self.active and self.status == List.PUBLISHED)
+
+    def clone(self, user=None):
+        """Clones this list and its active items into a new DRAFT version.
+        See ListManager.cloneMany()."""
+        clones = List.objects.cloneMany([self.pk], user)
+        return List.objects.get(pk=clones[self.pk])
+
+    def versionHistory(self):
+        """Returns this list followed by the lists it was cloned from, newest
+        first, walking the parentList chain in one query. Each list has a
+        distance attribute: 0 for this list, 1 for its parent, and so on."""
+        return list(List.objects.raw("""
+            WITH RECURSIVE chain AS (
+                SELECT l.*, 0 AS distance FROM lists_list l WHERE l.id = %s
+                UNION ALL
+                SELECT p.*, c.distance + 1
+                    FROM lists_list p INNER JOIN chain c ON p.id = c."parentList_id"
+            )
+            SELECT * FROM chain ORDER BY distance
+        """, [self.pk]))
+
+    def moveItem(self, item_id, position):
+        """Moves an item to position (an _order value) in this list.
+
+        Only the items between the old and the new position shift by one,
+        with a single UPDATE, instead of rewriting every row of the list like
+        set_listitem_order(). Returns the position the item ended up at.
+        """
+        return self.moveItems([(item_id, position)])[-1]
+
+    def moveItems(self, moves):
+        """Applies a sequence of (item_id, position) moves in one transaction.
+        Returns the final position of each moved item."""
+        from django.db import transaction
+        now = timezone.now()
+        positions = []
+        with transaction.atomic():
+            # serialize concurrent reorders of the same list
+            List.objects.select_for_update().filter(pk=self.pk).exists()
+            items = ListItem.objects.filter(list=self)
+            last = items.aggregate(last=models.Max('_order'))['last']
+            for item_id, position in moves:
+                current = items.filter(pk=item_id).values_list('_order', flat=True).first()
+                if current is None:
+                    raise ListItem.DoesNotExist('Item %s is not in list %s' % (item_id, self.pk))
+                position = max(0, min(int(position), last))
+                if position < current:
+                    items.filter(_order__gte=position, _order__lt=current).update(
+                        _order=models.F('_order') + 1, dateModified=now)
+                elif position > current:
+                    items.filter(_order__gt=current, _order__lte=position).update(
+                        _order=models.F('_order') - 1, dateModified=now)
+                else:
+                    positions.append(position)
+                    continue
+                items.filter(pk=item_id).update(_order=position, dateModified=now)
+                positions.append(position)
+            # touches dateModified and queues the list for reindexing
+            self.save(update_fields=['dateModified'])
+        return positions
+
+class TopicListStatsManager(models.Manager):
+    def forTopics(self, topic_ids):
+        """Returns {topic_id: TopicListStats} for topic_ids"""
+        return self.in_bulk(topic_ids)
+
+    def applyChange(self, old, new):
+        """Updates the counts after a list changed from old to new.
+
+        old and new are (topic_id, counted) pairs, where counted says whether
+        the list is published and active; None stands for a list that did not
+        exist before or no longer exists. Touches only the rows of the two
+        topics and their ancestors.
+        """
+        now = timezone.now()
+        if old == new:
+            if new and new[1]:
+                # a counted list was edited in place
+                self._update(new[0], 0, now)
+            return
+        if old and old[1]:
+            self._update(old[0], -1, now)
+        if new and new[1]:
+            self._update(new[0], 1, now)
+
+    def _update(self, topic_id, delta, now):
+        if topic_id is None:
+            return
+        self.filter(topic=topic_id).update(
+            directCount=models.F('directCount') + delta,
+            subtreeCount=models.F('subtreeCount') + delta,
+            lastModified=now
+        )
+        ancestors = TopicClosure.objects.filter(descendant=topic_id).values('ancestor')
+        self.filter(topic__in=ancestors).update(
+            subtreeCount=models.F('subtreeCount') + delta,
+            lastModified=now
+        )
+
+    def applyPaths(self, pairs, sign):
+        """Adds (sign 1) or subtracts (sign -1) the directCount of every
+        descendant to the subtreeCount of its ancestor, for (ancestor,
+        descendant) closure pairs that were just connected or disconnected.
+        Each pair stands for a distinct path, so no list is counted twice."""
+        if not pairs:
+            return
+        from django.db import connection
+        ancestors, descendants = zip(*pairs)
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                UPDATE lists_topicliststats s
+                    SET "subtreeCount" = s."subtreeCount" + %(sign)s * d.n,
+                        "lastModified" = CASE WHEN %(sign)s > 0
+                            THEN GREATEST(s."lastModified", d.modified) ELSE s."lastModified" END
+                    FROM (
+                        SELECT p.ancestor_id, SUM(ds."directCount") AS n, MAX(ds."lastModified") AS modified
+                            FROM unnest(%(ancestors)s::integer[], %(descendants)s::integer[])
+                                    AS p(ancestor_id, descendant_id)
+                                INNER JOIN lists_topicliststats ds ON ds.topic_id = p.descendant_id
+                            GROUP BY p.ancestor_id
+                    ) d
+                    WHERE s.topic_id = d.ancestor_id AND d.n <> 0
+            """, {'sign': sign, 'ancestors': list(ancestors), 'descendants': list(descendants)})
+
+    def removeTopic(self, topic_id):
+        """Drops the lists filed directly under topic_id from every count,
+        before the topic is deleted and its lists lose their topic without
+        sending signals. Its descendants' lists are subtracted as its edges go."""
+        row = self.filter(topic=topic_id).values_list('directCount', flat=True).first()
+        if row:
+            self._update(topic_id, -row, timezone.now())
+            self.filter(topic=topic_id).update(directCount=0)
+
+    def recompute(self):
+        """Recomputes every row from the List table. Used for repairs, by
+        the recompute_topic_stats command."""
+        from django.db import connection, transaction
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(RECOMPUTE_TOPIC_LIST_STATS_SQL, {'status': List.PUBLISHED})
+
+
+RECOMPUTE_TOPIC_LIST_STATS_SQL = """
+    INSERT INTO lists_topicliststats (topic_id, "directCount", "subtreeCount")
+        SELECT n.id, 0, 0 FROM lists_topicnode n
+            WHERE NOT EXISTS (SELECT 1 FROM lists_topicliststats s WHERE s.topic_id = n.id);
+    WITH counted AS (
+        SELECT topic_id, "dateModified" FROM lists_list
+            WHERE active AND status = %(status)s AND topic_id IS NOT NULL
+    ), direct AS (
+        SELECT topic_id, COUNT(*) AS n, MAX("dateModified") AS modified
+            FROM counted GROUP BY topic_id
+    ), subtree AS (
+        SELECT topic_id, COUNT(*) AS n, MAX(modified) AS modified FROM (
+            SELECT topic_id, "dateModified" AS modified FROM counted
+            UNION ALL
+            SELECT cl.ancestor_id, c."dateModified"
+                FROM counted c INNER JOIN lists_topicclosure cl ON cl.descendant_id = c.topic_id
+        ) under GROUP BY topic_id
+    )
+    UPDATE lists_topicliststats s
+        SET "directCount" = COALESCE(direct.n, 0),
+            "subtreeCount" = COALESCE(subtree.n, 0),
+            "lastModified" = subtree.modified
+        FROM lists_topicnode n
+            LEFT JOIN direct ON direct.topic_id = n.id
+            LEFT JOIN subtree ON subtree.topic_id = n.id
+        WHERE s.topic_id = n.id;
+"""
+
+# TopicListStats - precomputed counts of the published, active lists filed
+#                  under a topic, so topic pages need no COUNT over lists.
+#                  Kept current by the List and TopicNode signal handlers in
+#                  signals.py and by TopicEdge.save()/delete(), which adjust
+#                  only the ancestors whose paths changed;
+#                  `manage.py recompute_topic_stats` rebuilds it.
+#   - topic: the TopicNode ID these counts belong to
+#   - directCount: number of lists whose topic is this topic
+#   - subtreeCount: number of lists whose topic is this topic or one of its
+#     descendants
+#   - lastModified: timestamp of the latest change to a counted list
+class TopicListStats(models.Model):
+    topic = models.OneToOneField(TopicNode,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='listStats'
+    )
+    directCount = models.IntegerField(default=0)
+    subtreeCount = models.IntegerField(default=0)
+    lastModified = models.DateTimeField(null=True, blank=True)
+    objects = TopicListStatsManager()
+
 # ListItem - A single item in a checklist. All items belonging to the same list
 #            have a defined order in that list, which can be accessed and set
 #            with l.get_listitem_order() and l.set_listitem_order() where l is
-#            a list.
+#            a list. To move single items, use l.moveItem() and l.moveItems(),
+#            which only update the rows that shift.
 #   - title: the visible top-level text describing the item
 #   - description: a short textual description of the item visible if you click
 #     on the item's title
@@ -301,10 +885,61 @@ class ListItem(models.Model):
 
     class Meta:
         order_with_respect_to = 'list'
+        # keyset pagination of a list's items walks this index
+        index_together = [('list', '_order')]
 
     def __str__(self):
         return self.title
 
+
+class ListSnapshotManager(models.Manager):
+    def refresh(self, list_id):
+        """Rebuilds the snapshot of list_id if the list is published and
+        deletes it otherwise. Returns the snapshot or None."""
+        from django.db import transaction
+        from .encoders import dumps
+        with transaction.atomic():
+            lists = list(List.objects.filter(pk=list_id, status=List.PUBLISHED).values(
+                *ListSnapshot.LIST_FIELDS))
+            if not lists:
+                self.filter(list_id=list_id).delete()
+                return None
+            items = list(ListItem.objects.filter(list=list_id, active=True).order_by(
+                '_order').values(*ListSnapshot.ITEM_FIELDS))
+            lastModified = max([lists[0]['dateModified']] + [i['dateModified'] for i in items])
+            snapshot, created = self.update_or_create(list_id=list_id, defaults={
+                'data': dumps({'list': lists[0], 'listItems': items}),
+                'lastModified': lastModified,
+            })
+        return snapshot
+
+# ListSnapshot - the rendered JSON of a published list and its ordered, active
+#                items. Published lists can no longer be edited, so their
+#                reads are served from this one row (and the in-memory
+#                lists.snapshots.snapshots store in front of it) instead of
+#                querying List and ListItem. Rebuilt by the signal handlers in
+#                signals.py when a published list or its items are saved;
+#                `manage.py rebuild_snapshots` rebuilds all of them.
+#   - list: the published List ID
+#   - data: {"list": {...LIST_FIELDS}, "listItems": [{...ITEM_FIELDS}, ...]}
+#   - lastModified: latest dateModified of the list and its active items
+#   - dateBuilt: timestamp of when the snapshot was last built
+class ListSnapshot(models.Model):
+    LIST_FIELDS = ('id', 'title', 'description', 'topic_id', 'topic__name', 'status',
+                   'version', 'dateCreated', 'dateModified')
+    ITEM_FIELDS = ('id', '_order', 'title', 'description', 'deepDive', 'list_id',
+                   'dateCreated', 'dateModified')
+
+    list = models.OneToOneField(List,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='snapshot'
+    )
+    data = models.TextField()
+    lastModified = models.DateTimeField()
+    dateBuilt = models.DateTimeField(auto_now=True)
+    objects = ListSnapshotManager()
+
 # List Comments - comments made on a list (for example by an editor during review)
 class ListComment(models.Model):
     message = models.TextField()
@@ -525,3 +1160,41 @@ class Proposal(models.Model):
 
     def __str__(self):
         return self.message
+
+
+# SearchOutbox - a pending change to the search index, written in the same
+#                transaction as the model change by the handlers in signals.py
+#                and consumed in bulk by the es_sync command.
+#   - docType: es_type_name of the document to refresh
+#   - objectId: pk of the document to refresh (reindexed if the row still
+#     exists, deleted from the index otherwise)
+#   - dateCreated: timestamp of row creation
+class SearchOutbox(models.Model):
+    docType = models.CharField(max_length=30)
+    objectId = models.PositiveIntegerField()
+    dateCreated = models.DateTimeField(auto_now_add=True, blank=True)
+
+
+class VersionStampManager(models.Manager):
+    def current(self, name):
+        value = self.filter(name=name).values_list('value', flat=True).first()
+        return value or 0
+
+    def bump(self, name):
+        stamp, created = self.get_or_create(name=name)
+        self.filter(pk=stamp.pk).update(value=models.F('value') + 1, dateModified=timezone.now())
+
+# VersionStamp - a named counter bumped whenever some derived, cached data
+#                (e.g. the in-memory TopicGraph) has to be rebuilt.
+#   - name: identifies what the stamp versions
+#   - value: incremented on every change
+#   - dateModified: timestamp of when the row was last modified
+@python_2_unicode_compatible
+class VersionStamp(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    dateModified = models.DateTimeField(auto_now=True, blank=True)
+    objects = VersionStampManager()
+
+    def __str__(self):
+        return '%s:%d' % (self.name, self.value)
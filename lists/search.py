@@ -0,0 +1,487 @@
+"""Structured full-text search over lists, and the backends that serve it.
+
+build_list_query() turns validated ListQueryForm data into a search body:
+a boosted multi_match over the analyzed text fields of the List es_mapping,
+with status, active, topic subtree and date range as non-scoring filters,
+highlighting and a _source limited to LIST_SOURCE_FIELDS.
+
+Results are paged with an opaque cursor holding the sort values of the last
+hit. With settings.ES_SEARCH_AFTER (Elasticsearch 5 and later) the cursor is
+sent as search_after. Older clusters do not support search_after, so there
+browsing without a query string applies the sort values as a keyset range
+filter instead, and relevance sorted pages fall back to from/size up to
+MAX_RESULT_WINDOW.
+
+The views go through get_search_backend(), which picks the backend named by
+settings.SEARCH_BACKEND. 'elasticsearch' sends suggest and search calls to
+Elasticsearch and fails over to PostgresSearchBackend while Elasticsearch is
+unreachable; 'postgres' always uses the latter, and 'memory' the in-process
+index of lists.memsearch, which needs no service at all. The PostgreSQL backend searches the trigger
+maintained search_vector columns (see migration 0007) and reads cursors of
+the same shape, so paging can continue across a failover.
+"""
+import base64
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from elasticsearch.exceptions import ConnectionError, TransportError
+
+from .esclient import get_client
+from .topicgraph import get_topic_graph
+
+# returned to clients; the item texts are only searched and highlighted
+LIST_SOURCE_FIELDS = ['id', 'title', 'description', 'topic.id', 'topic.name',
+                      'status', 'active', 'creator', 'dateCreated', 'dateModified']
+LIST_QUERY_FIELDS = ['title^3', 'topic.name^2', 'description^1.5',
+                     'listItems.title', 'listItems.description', 'listItems.deepdive^0.5']
+LIST_HIGHLIGHT = {
+    'pre_tags': ['<em>'],
+    'post_tags': ['</em>'],
+    'fields': {
+        'title': {'number_of_fragments': 0},
+        'description': {'fragment_size': 150, 'number_of_fragments': 1},
+        'listItems.title': {'fragment_size': 150, 'number_of_fragments': 3},
+        'listItems.description': {'fragment_size': 150, 'number_of_fragments': 1},
+    }
+}
+# newest first, id breaks ties so the order is total
+BROWSE_SORT = [{'dateCreated': {'order': 'desc'}}, {'id': {'order': 'desc'}}]
+DEFAULT_PAGE_SIZE = 20
+# index.max_result_window default
+MAX_RESULT_WINDOW = 10000
+# completion suggester default
+SUGGEST_SIZE = 5
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+    except (TypeError, ValueError):
+        raise InvalidCursor('invalid cursor')
+    if not isinstance(data, dict) or not isinstance(data.get('after'), list):
+        raise InvalidCursor('invalid cursor')
+    return data
+
+
+def topic_subtree(topic_id):
+    """Returns topic_id and the ids of all its descendants"""
+    topics = get_topic_graph().descendants(topic_id)
+    topics.add(topic_id)
+    return sorted(topics)
+
+
+def build_filters(params):
+    from .models import List
+    filters = [
+        {'term': {'status': params.get('status') or List.PUBLISHED}},
+        {'term': {'active': params.get('active') is not False}},
+    ]
+    if params.get('topic') is not None:
+        filters.append({'terms': {'topic.id': topic_subtree(params['topic'])}})
+    dateRange = {}
+    if params.get('dateFrom'):
+        dateRange['gte'] = params['dateFrom'].isoformat()
+    if params.get('dateTo'):
+        dateRange['lte'] = params['dateTo'].isoformat()
+    if dateRange:
+        filters.append({'range': {'dateCreated': dateRange}})
+    return filters
+
+
+def keyset_filter(after):
+    """Matches documents sorting after [dateCreated, id] in BROWSE_SORT"""
+    dateCreated, listId = after
+    return {'bool': {'should': [
+        {'range': {'dateCreated': {'lt': dateCreated}}},
+        {'bool': {'filter': [
+            {'term': {'dateCreated': dateCreated}},
+            {'range': {'id': {'lt': listId}}},
+        ]}},
+    ], 'minimum_should_match': 1}}
+
+
+def page_offset(cursor, size):
+    offset = cursor.get('from')
+    if not isinstance(offset, int) or not 0 <= offset <= MAX_RESULT_WINDOW - size:
+        raise InvalidCursor('cannot page past %d results' % MAX_RESULT_WINDOW)
+    return offset
+
+
+def build_list_query(params):
+    """Returns the search body for cleaned ListQueryForm data. Raises
+    InvalidCursor if the cursor is malformed or past MAX_RESULT_WINDOW."""
+    size = params.get('size') or DEFAULT_PAGE_SIZE
+    cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+    filters = build_filters(params)
+    text = (params.get('q') or '').strip()
+    body = {
+        'size': size,
+        '_source': LIST_SOURCE_FIELDS,
+    }
+    if text:
+        body['sort'] = ['_score'] + BROWSE_SORT
+        body['highlight'] = LIST_HIGHLIGHT
+        query = {'multi_match': {
+            'query': text,
+            'fields': LIST_QUERY_FIELDS,
+            'type': 'best_fields',
+            'tie_breaker': 0.3,
+        }}
+    else:
+        body['sort'] = BROWSE_SORT
+        query = {'match_all': {}}
+    if cursor is not None:
+        if getattr(settings, 'ES_SEARCH_AFTER', False):
+            body['search_after'] = cursor['after']
+        elif not text:
+            if len(cursor['after']) != 2:
+                raise InvalidCursor('invalid cursor')
+            filters.append(keyset_filter(cursor['after']))
+        else:
+            body['from'] = page_offset(cursor, size)
+    body['query'] = {'bool': {'must': query, 'filter': filters}}
+    return body
+
+
+def parse_hits(resp, body):
+    """Returns (lists, next cursor) from a search response"""
+    hits = resp['hits']['hits']
+    lists = []
+    for hit in hits:
+        data = hit.get('_source', {})
+        data['id'] = int(hit['_id'])
+        data['score'] = hit.get('_score')
+        if 'highlight' in hit:
+            data['highlight'] = hit['highlight']
+        lists.append(data)
+    nextCursor = None
+    if len(hits) == body['size']:
+        offset = body.get('from', 0) + len(hits)
+        if offset < resp['hits']['total']:
+            nextCursor = encode_cursor({'after': hits[-1]['sort'], 'from': offset})
+    return lists, nextCursor
+
+
+def search_lists(client, params):
+    """Runs a list query. Returns {'lists', 'total', 'next'}"""
+    body = build_list_query(params)
+    resp = client.search(index=settings.INDEX_NAME, doc_type='list', body=body,
+                         request_timeout=settings.ES_SEARCH_TIMEOUT)
+    lists, nextCursor = parse_hits(resp, body)
+    return {
+        'lists': lists,
+        'total': resp['hits']['total'],
+        'next': nextCursor,
+    }
+
+
+class ElasticsearchBackend(object):
+    name = 'elasticsearch'
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        return self._client or get_client()
+
+    def suggest(self, term):
+        """Returns [{'id', 'value'}] for the topic names completing term"""
+        resp = self.client.suggest(
+            index=settings.INDEX_NAME,
+            body={
+                'name_complete': {
+                    'text': term,
+                    'completion': {
+                        'field': 'name_complete',
+                        'size': SUGGEST_SIZE,
+                    }
+                }
+            },
+            request_timeout=settings.ES_SEARCH_TIMEOUT
+        )
+        options = resp['name_complete'][0]['options']
+        return [{'id': i['payload']['pk'], 'value': i['text']} for i in options]
+
+    def search(self, params):
+        return search_lists(self.client, params)
+
+
+PG_TSQUERY = "plainto_tsquery('pg_catalog.english', %(q)s)"
+# dates are compared at the millisecond precision of the search index, so
+# cursors from either backend page the same way. Converted to UTC first, the
+# expression is immutable and matches the lists_list_browse index (migration
+# 0010) column for column.
+PG_SORT_DATE = ("(EXTRACT(EPOCH FROM date_trunc('milliseconds', "
+                "l.\"dateCreated\" AT TIME ZONE 'UTC')) * 1000)::bigint")
+PG_HEADLINE = "ts_headline('pg_catalog.english', {0}, " + PG_TSQUERY + ", '{1}')"
+
+
+class PostgresSearchBackend(object):
+    """Searches the search_vector columns of lists and their items.
+
+    Lists match on their own title and description or on any active item;
+    item matches rank at half weight. Text queries are served by the GIN
+    indexes on search_vector, browsing by the index on status, active and
+    PG_SORT_DATE, and suggestions by the prefix index on topic names.
+    """
+    name = 'postgres'
+
+    def suggest(self, term):
+        prefix = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT id, name FROM lists_topicnode
+                    WHERE lower(name) LIKE lower(%s)
+                    ORDER BY lower(name), id
+                    LIMIT %s
+            """, [prefix, SUGGEST_SIZE])
+            return [{'id': pk, 'value': name} for pk, name in cursor.fetchall()]
+
+    def search(self, params):
+        from .models import List
+        size = params.get('size') or DEFAULT_PAGE_SIZE
+        cursor = decode_cursor(params['cursor']) if params.get('cursor') else None
+        text = (params.get('q') or '').strip()
+        args = {
+            'status': params.get('status') or List.PUBLISHED,
+            'active': params.get('active') is not False,
+            'size': size,
+            'offset': 0,
+        }
+        where = ['l.status = %(status)s', 'l.active = %(active)s']
+        if params.get('topic') is not None:
+            where.append('l.topic_id = ANY(%(topics)s)')
+            args['topics'] = topic_subtree(params['topic'])
+        if params.get('dateFrom'):
+            where.append('l."dateCreated" >= %(dateFrom)s')
+            args['dateFrom'] = params['dateFrom']
+        if params.get('dateTo'):
+            where.append('l."dateCreated" <= %(dateTo)s')
+            args['dateTo'] = params['dateTo']
+        if text:
+            args['q'] = text
+            source = """lists_list l INNER JOIN (
+                SELECT id, SUM(rank) AS rank FROM (
+                    SELECT id, ts_rank(search_vector, {q}) AS rank
+                        FROM lists_list WHERE search_vector @@ {q}
+                    UNION ALL
+                    SELECT list_id, 0.5 * MAX(ts_rank(search_vector, {q}))
+                        FROM lists_listitem WHERE active AND search_vector @@ {q}
+                        GROUP BY list_id
+                ) ranked GROUP BY id
+            ) m ON m.id = l.id""".format(q=PG_TSQUERY)
+            score = 'm.rank'
+            total = 'COUNT(*) OVER ()'
+            order = 'm.rank DESC, sort_date DESC, l.id DESC'
+            if cursor is not None:
+                args['offset'] = page_offset(cursor, size)
+            highlight = ', {0} AS title_hl, {1} AS description_hl'.format(
+                PG_HEADLINE.format('page.title', 'StartSel=<em>, StopSel=</em>, HighlightAll=TRUE'),
+                PG_HEADLINE.format('page.description', 'StartSel=<em>, StopSel=</em>, MaxFragments=1'))
+        else:
+            source = 'lists_list l'
+            score = 'NULL::real'
+            # counting every published list would scan them all
+            total = 'NULL::bigint'
+            order = 'sort_date DESC, l.id DESC'
+            if cursor is not None:
+                if len(cursor['after']) != 2:
+                    raise InvalidCursor('invalid cursor')
+                where.append('(' + PG_SORT_DATE + ', l.id) < (%(afterDate)s, %(afterId)s)')
+                args['afterDate'], args['afterId'] = cursor['after']
+            highlight = ''
+        sql = """
+            SELECT page.*{highlight} FROM (
+                SELECT l.id, l.title, l.description, l.topic_id, t.name AS topic_name,
+                        l.status, l.active, u.username AS creator,
+                        l."dateCreated", l."dateModified",
+                        {score} AS score, {sort_date} AS sort_date, {total} AS total
+                    FROM {source}
+                        LEFT OUTER JOIN lists_topicnode t ON t.id = l.topic_id
+                        LEFT OUTER JOIN auth_user u ON u.id = l.creator_id
+                    WHERE {where}
+                    ORDER BY {order}
+                    LIMIT %(size)s OFFSET %(offset)s
+            ) page
+            ORDER BY page.score DESC NULLS LAST, page.sort_date DESC, page.id DESC
+        """.format(highlight=highlight, score=score, sort_date=PG_SORT_DATE, total=total,
+                   source=source, where=' AND '.join(where), order=order)
+        with connection.cursor() as dbcursor:
+            dbcursor.execute(sql, args)
+            columns = [col[0] for col in dbcursor.description]
+            rows = [dict(zip(columns, row)) for row in dbcursor.fetchall()]
+        if rows:
+            total = rows[0]['total']
+        else:
+            total = 0 if cursor is None else None
+        return self.format_results(rows, text, size, args['offset'], total)
+
+    def format_results(self, rows, text, size, offset, total):
+        lists = []
+        for row in rows:
+            data = dict((k, row[k]) for k in ('id', 'title', 'description', 'status', 'active',
+                                              'creator', 'dateCreated', 'dateModified'))
+            data['topic'] = {'id': row['topic_id'], 'name': row['topic_name']} if row['topic_id'] else None
+            data['score'] = row['score']
+            if text:
+                highlight = dict((field, [row[field + '_hl']]) for field in ('title', 'description')
+                                 if '<em>' in (row[field + '_hl'] or ''))
+                if highlight:
+                    data['highlight'] = highlight
+            lists.append(data)
+        nextCursor = None
+        if len(rows) == size and (total is None or offset + size < total):
+            last = rows[-1]
+            after = [last['sort_date'], last['id']]
+            if text:
+                after.insert(0, last['score'])
+            nextCursor = encode_cursor({'after': after, 'from': offset + size})
+        return {
+            'lists': lists,
+            'total': total,
+            'next': nextCursor,
+        }
+
+
+class CircuitBreaker(object):
+    """Tracks consecutive failures of a dependency.
+
+    After failure_threshold failures in a row the circuit opens and allow()
+    returns False for reset_timeout seconds. Then a single trial call is let
+    through; its success() closes the circuit, its failure() opens it again.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._openedAt = None
+        self._trialAt = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._openedAt is None:
+            return 'closed'
+        if time.time() - self._openedAt < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        with self._lock:
+            if self._openedAt is None:
+                return True
+            now = time.time()
+            if now - self._openedAt < self.reset_timeout:
+                return False
+            # a trial that never reported back must not keep the circuit open
+            if self._trialAt is not None and now - self._trialAt < self.reset_timeout:
+                return False
+            self._trialAt = now
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._openedAt = None
+            self._trialAt = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trialAt = None
+            if self._failures >= self.failure_threshold:
+                self._openedAt = time.time()
+
+
+def is_unavailable(exc):
+    """Whether exc means the search cluster could not serve the request, as
+    opposed to rejecting it"""
+    if isinstance(exc, ConnectionError):
+        return True
+    if isinstance(exc, TransportError):
+        return not isinstance(exc.status_code, int) or exc.status_code >= 500
+    return False
+
+
+class FailoverSearchBackend(object):
+    """Calls primary while its circuit is closed and fallback otherwise"""
+
+    def __init__(self, primary, fallback, breaker):
+        self.primary = primary
+        self.fallback = fallback
+        self.breaker = breaker
+        self._local = threading.local()
+
+    @property
+    def degraded(self):
+        """Whether this thread's last call was answered by the fallback"""
+        return getattr(self._local, 'degraded', False)
+
+    @property
+    def name(self):
+        return self.primary.name if self.breaker.state == 'closed' else self.fallback.name
+
+    def _call(self, method, *args):
+        if self.breaker.allow():
+            try:
+                result = getattr(self.primary, method)(*args)
+            except TransportError as e:
+                if not is_unavailable(e):
+                    raise
+                self.breaker.failure()
+                logger.warning('%s %s failed, using %s: %s',
+                               self.primary.name, method, self.fallback.name, e)
+            else:
+                self.breaker.success()
+                self._local.degraded = False
+                return result
+        self._local.degraded = True
+        return getattr(self.fallback, method)(*args)
+
+    def suggest(self, term):
+        return self._call('suggest', term)
+
+    def search(self, params):
+        return self._call('search', params)
+
+
+_backend = None
+
+
+def create_search_backend(name):
+    if name == 'elasticsearch':
+        return FailoverSearchBackend(
+            ElasticsearchBackend(),
+            PostgresSearchBackend(),
+            CircuitBreaker(settings.SEARCH_FAILURE_THRESHOLD, settings.SEARCH_RETRY_INTERVAL))
+    if name == 'postgres':
+        return PostgresSearchBackend()
+    if name == 'memory':
+        from .memsearch import MemorySearchBackend
+        return MemorySearchBackend()
+    raise ImproperlyConfigured('Unknown SEARCH_BACKEND %r' % name)
+
+
+def get_search_backend():
+    """Returns this process's backend of settings.SEARCH_BACKEND"""
+    global _backend
+    if _backend is None:
+        _backend = create_search_backend(settings.SEARCH_BACKEND)
+    return _backend
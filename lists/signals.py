@@ -0,0 +1,123 @@
+"""Model signal handlers that keep derived data in sync: queued search index
+changes in the SearchOutbox, the TopicClosure, TopicListStats and
+ListSnapshot tables and the version stamps of the in-memory TopicGraph and
+subscriber entitlements."""
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .entitlements import subscriptions_changed
+from .models import (List, ListItem, SearchOutbox, Subscriber, Subscription,
+                     TopicClosure, TopicEdge, TopicListStats, TopicNode)
+from .snapshots import snapshots
+from .topicgraph import topic_edges_changed
+
+
+def enqueue(doc_type, object_ids):
+    """Queues documents of doc_type for reindexing by the es_sync consumer"""
+    SearchOutbox.objects.bulk_create(
+        [SearchOutbox(docType=doc_type, objectId=pk) for pk in set(object_ids)]
+    )
+
+
+@receiver(post_save, sender=TopicNode)
+@receiver(post_delete, sender=TopicNode)
+def topicnode_changed(sender, instance, **kwargs):
+    enqueue(TopicNode._meta.es_type_name, [instance.pk])
+
+
+@receiver(post_save, sender=List)
+@receiver(post_delete, sender=List)
+def list_changed(sender, instance, **kwargs):
+    enqueue(List._meta.es_type_name, [instance.pk])
+
+
+@receiver(post_save, sender=TopicNode)
+def topicnode_created(sender, instance, created, **kwargs):
+    if created:
+        TopicListStats.objects.create(topic=instance)
+
+
+@receiver(pre_delete, sender=TopicNode)
+def topicnode_deleting(sender, instance, **kwargs):
+    # the topic's lists get a NULL topic in bulk, without List signals
+    TopicListStats.objects.removeTopic(instance.pk)
+    # delete the edges while the closure still holds the paths through the
+    # topic, which the cascade would otherwise remove first
+    TopicEdge.objects.filter(Q(parent=instance) | Q(child=instance)).delete()
+
+
+@receiver(pre_save, sender=List)
+def list_pre_save(sender, instance, **kwargs):
+    # remember what the counts saw before this save
+    instance._previous_stats = None
+    instance._previous_status = None
+    if instance.pk:
+        previous = List.objects.filter(pk=instance.pk).values_list(
+            'topic_id', 'active', 'status').first()
+        if previous:
+            topic_id, active, status = previous
+            instance._previous_stats = (topic_id, active and status == List.PUBLISHED)
+            instance._previous_status = status
+
+
+@receiver(post_save, sender=List)
+def list_stats_saved(sender, instance, **kwargs):
+    TopicListStats.objects.applyChange(
+        getattr(instance, '_previous_stats', None), instance.statsKey())
+
+
+@receiver(post_delete, sender=List)
+def list_stats_deleted(sender, instance, **kwargs):
+    TopicListStats.objects.applyChange(instance.statsKey(), None)
+
+
+@receiver(post_save, sender=ListItem)
+@receiver(post_delete, sender=ListItem)
+def listitem_changed(sender, instance, **kwargs):
+    # items are embedded in the List document
+    enqueue(List._meta.es_type_name, [instance.list_id])
+
+
+def refresh_snapshot(list_id):
+    # after commit, so items written later in the same transaction are included
+    transaction.on_commit(lambda: snapshots.refresh(list_id))
+
+
+@receiver(post_save, sender=List)
+def list_snapshot_saved(sender, instance, **kwargs):
+    if List.PUBLISHED in (instance.status, getattr(instance, '_previous_status', None)):
+        refresh_snapshot(instance.pk)
+
+
+@receiver(post_delete, sender=List)
+def list_snapshot_deleted(sender, instance, **kwargs):
+    list_id = instance.pk
+    transaction.on_commit(lambda: snapshots.invalidate(list_id))
+
+
+@receiver(post_save, sender=ListItem)
+@receiver(post_delete, sender=ListItem)
+def listitem_snapshot_changed(sender, instance, **kwargs):
+    # only published lists have a snapshot; the views save items with their
+    # list already attached, so this reads no extra row
+    if instance.list.status == List.PUBLISHED:
+        refresh_snapshot(instance.list_id)
+
+
+# TopicEdge.save() updates the closure table itself. Deletes, including
+# queryset deletes, run this inside the deleting transaction.
+@receiver(post_delete, sender=TopicEdge)
+def topicedge_deleted(sender, instance, **kwargs):
+    removed = TopicClosure.objects.removeEdge(instance.parent_id, instance.child_id)
+    TopicListStats.objects.applyPaths(removed, -1)
+    topic_edges_changed()
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_save, sender=Subscriber)
+@receiver(post_delete, sender=Subscriber)
+def subscription_changed(sender, instance, **kwargs):
+    subscriptions_changed()
@@ -0,0 +1,69 @@
+"""In-memory store of published list snapshots.
+
+The ListSnapshot rows hold the rendered JSON of every published list. This
+store keeps parsed snapshots in a local LRU, so reads of a hot published list
+need no query at all. Lists without a snapshot are cached as such too, and
+their reads fall back to the List and ListItem tables.
+
+A rebuild only drops the entry of the worker that made it. Other workers pick
+it up after SNAPSHOT_CACHE_TTL seconds, which is harmless for lists that are
+published, as those cannot be edited; only admin changes to a published list
+take up to that long to show everywhere.
+"""
+import hashlib
+import json
+from bisect import bisect_right
+
+from django.conf import settings
+
+from .cache import LRUCache
+
+
+class Snapshot(object):
+    def __init__(self, data, lastModified):
+        parsed = json.loads(data)
+        self.list = parsed['list']
+        self.listItems = parsed['listItems']
+        self.lastModified = lastModified
+        self.etag = hashlib.md5(data.encode('utf-8')).hexdigest()
+        self._orders = [item['_order'] for item in self.listItems]
+        self._byId = dict((item['id'], item) for item in self.listItems)
+
+    def item(self, item_id):
+        return self._byId.get(item_id)
+
+    def itemRows(self, after=None, fields=None):
+        """Yields the items following _order after, with only fields"""
+        start = 0 if after is None else bisect_right(self._orders, after)
+        for item in self.listItems[start:]:
+            if fields is None:
+                yield item
+            else:
+                yield dict((f, item[f]) for f in fields)
+
+
+class SnapshotStore(object):
+    def __init__(self):
+        self.local = LRUCache(settings.SNAPSHOT_CACHE_SIZE, settings.SNAPSHOT_CACHE_TTL)
+
+    def get(self, list_id):
+        """Returns the Snapshot of list_id, or None if it is not published"""
+        from .models import ListSnapshot
+        snapshot = self.local.get(list_id)
+        if snapshot is None:
+            rows = ListSnapshot.objects.filter(list_id=list_id).values_list('data', 'lastModified')
+            # False marks lists known to have no snapshot
+            snapshot = Snapshot(*rows[0]) if rows else False
+            self.local.set(list_id, snapshot)
+        return snapshot or None
+
+    def invalidate(self, list_id):
+        self.local.delete(list_id)
+
+    def refresh(self, list_id):
+        from .models import ListSnapshot
+        ListSnapshot.objects.refresh(list_id)
+        self.invalidate(list_id)
+
+
+snapshots = SnapshotStore()
@@ -1,3 +1,748 @@
-from django.test import TestCase
+import datetime
+import json
+import time
+from unittest import skipIf
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from elasticsearch.exceptions import ConnectionError
+
+from .benchmarks.datagen import layout
+from .cache import SuggestCache
+from .db import iter_keyset
+from .indexing import replay_outbox
+from . import encoders, topicgraph
+from .encoders import BACKENDS, StdlibEncoder, json_serial, load_encoder
+from .entitlements import EntitlementResolver
+from .memsearch import MemorySearchBackend
+from .metrics import Histogram, QueryBudgetExceeded
+from .models import (List, ListItem, ListSnapshot, Person, SearchOutbox, Subscriber,
+                     SubscriberGroup, Subscription, TopicClosure, TopicEdge, TopicListStats,
+                     TopicNode, findCycleNodes)
+from .search import CircuitBreaker, FailoverSearchBackend, PostgresSearchBackend
+from .snapshots import SnapshotStore, snapshots
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONEncoderParityMixin(object):
+    """Checks that an encoder backend produces the same JSON values as
+    the stdlib backend with json_serial"""
+    encoder_name = None
+
+    def setUp(self):
+        self.encoder = load_encoder(self.encoder_name)
+        self.reference = StdlibEncoder()
+
+    def assertParity(self, obj):
+        self.assertEqual(json.loads(self.encoder.dumps(obj)),
+                         json.loads(self.reference.dumps(obj)))
+
+    def test_naive_datetime_drops_microseconds(self):
+        value = datetime.datetime(2016, 7, 30, 16, 43, 12, 345678)
+        self.assertEqual(json.loads(self.encoder.dumps({'d': value})),
+                         {'d': '2016-07-30T16:43:12'})
+        self.assertParity({'d': value})
+
+    def test_aware_datetime(self):
+        value = datetime.datetime(2016, 7, 30, 16, 43, 12, 345678, tzinfo=timezone.utc)
+        self.assertEqual(json.loads(self.encoder.dumps(value)), json_serial(value))
+        self.assertParity(value)
+
+    def test_datetime_without_microseconds(self):
+        self.assertParity([datetime.datetime(2016, 1, 1)])
+
+    def test_nested_rows(self):
+        now = timezone.now()
+        self.assertParity({
+            'listItems': [
+                {'id': 1, '_order': 0, 'title': u'caf\xe9', 'dateCreated': now},
+                {'id': 2, '_order': 1, 'title': '', 'dateCreated': None},
+            ],
+            'next': None,
+            'active': True,
+            'score': 1.5,
+        })
+
+    def test_non_string_keys(self):
+        self.assertParity({1: 'a', 2: 'b'})
+
+    def test_unsupported_type_raises(self):
+        with self.assertRaises(TypeError):
+            self.encoder.dumps({'value': object()})
+
+
+class StdlibEncoderTests(JSONEncoderParityMixin, SimpleTestCase):
+    encoder_name = 'stdlib'
+
+
+@skipIf(orjson is None, 'orjson is not installed')
+class OrjsonEncoderTests(JSONEncoderParityMixin, SimpleTestCase):
+    encoder_name = 'orjson'
+
+
+class LoadEncoderTests(SimpleTestCase):
+    def test_auto_picks_an_available_backend(self):
+        self.assertIn(load_encoder('auto').name, BACKENDS)
+
+    def test_dotted_path(self):
+        self.assertIsInstance(load_encoder('lists.encoders.StdlibEncoder'), StdlibEncoder)
+
+
+class HistogramTests(SimpleTestCase):
+    def test_cumulative_buckets(self):
+        histogram = Histogram((1, 5))
+        for value in (0, 1, 3, 5, 7):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.cumulative()), [(1, 2), (5, 4), ('+Inf', 5)])
+        self.assertEqual((histogram.count, histogram.sum), (5, 16))
+
+
+@override_settings(METRICS_ENFORCE_BUDGETS=True)
+class QueryBudgetTests(TestCase):
+    """Requests every database backed view with lists of different sizes;
+    RequestMetricsMiddleware raises if one runs over VIEW_QUERY_BUDGETS"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='faria')
+        self.topic = TopicNode.objects.create(name='Budgets', description='')
+
+    def make_list(self, size, status=List.DRAFT):
+        lst = List.objects.create(title='List', topic=self.topic, creator=self.user, status=status)
+        ListItem.objects.bulk_create(
+            [ListItem(list=lst, title='Item %d' % i, _order=i) for i in range(size)])
+        return lst
+
+    def test_read_views(self):
+        for size in (1, 30):
+            for status in (List.DRAFT, List.PUBLISHED):
+                lst = self.make_list(size, status)
+                item = lst.listitem_set.first()
+                for url in (
+                        reverse('listapp:list-items', args=[lst.pk]),
+                        reverse('listapp:list-items', args=[lst.pk]) + '?stream=1',
+                        reverse('listapp:list-item-detail', args=[lst.pk, item.pk]),
+                        reverse('listapp:list-versions', args=[lst.pk]),
+                        reverse('listapp:list-export')):
+                    response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200, url)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+
+    def test_write_views(self):
+        for size in (2, 30):
+            lst = self.make_list(size)
+            data = {'title': 'New', 'description': '', 'topic': self.topic.pk, 'status': List.DRAFT}
+            for i in range(size):
+                data['item-%d-title' % i] = 'Item %d' % i
+            response = self.client.post(reverse('listapp:list-create', args=[lst.pk]), data)
+            self.assertEqual(response.status_code, 200)
+            items = list(lst.listitem_set.values_list('id', flat=True))
+            response = self.client.post(reverse('listapp:list-items-reorder', args=[lst.pk]),
+                                        {'item': items[:2], 'position': [size - 1, 0]})
+            self.assertEqual(response.status_code, 200)
+            List.objects.filter(pk=lst.pk).update(status=List.PUBLISHED)
+            response = self.client.post(reverse('listapp:list-clone', args=[lst.pk]))
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(STREAM_CHUNK_SIZE=4)
+    def test_streams_past_the_first_chunk(self):
+        # 8 items end on a chunk boundary, 9 do not
+        for size in (8, 9):
+            lst = self.make_list(size)
+            response = self.client.get(reverse('listapp:list-items', args=[lst.pk]) + '?stream=1')
+            body = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+            self.assertEqual([item['_order'] for item in body['listItems']], list(range(size)))
+        for i in range(9):
+            self.make_list(0, List.PUBLISHED)
+        response = self.client.get(reverse('listapp:list-export'))
+        body = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(len(body['lists']), 9)
+
+    def test_over_budget_fails(self):
+        lst = self.make_list(1)
+        with self.settings(VIEW_QUERY_BUDGETS={'listapp:list-versions': 0}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('listapp:list-versions', args=[lst.pk]))
+
+
+@override_settings(SUGGEST_CACHE_ALIAS=None, SUGGEST_CACHE_CHECK_INTERVAL=0)
+class SuggestCacheTests(TestCase):
+    def test_invalidation_reaches_other_processes(self):
+        worker, command = SuggestCache(), SuggestCache()
+        worker.set('Neu', b'[]')
+        self.assertEqual(worker.get('neu'), b'[]')
+        command.invalidate()
+        self.assertIsNone(worker.get('neu'))
+
+    def test_result_keeps_the_generation_it_was_computed_at(self):
+        cache = SuggestCache()
+        generation = cache.generation()
+        cache.invalidate()
+        cache.set('neu', b'["stale"]', generation)
+        self.assertIsNone(cache.get('neu'))
+
+    def test_short_ttl(self):
+        cache = SuggestCache()
+        cache.set('neu', b'[]', ttl=-1)
+        self.assertIsNone(cache.get('neu'))
+
+
+class IterKeysetTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='faria')
+        topic = TopicNode.objects.create(name='Streams', description='')
+        self.list = List.objects.create(title='List', topic=topic, creator=user)
+        ListItem.objects.bulk_create(
+            [ListItem(list=self.list, title='Item %d' % i, _order=i) for i in range(7)])
+
+    def test_reads_every_row_in_chunks(self):
+        qset = ListItem.objects.filter(list=self.list)
+        for chunk_size in (2, 7, 10):
+            with self.assertNumQueries(7 // chunk_size + 1):
+                rows = list(iter_keyset(qset, ('_order', 'title'), '_order', chunk_size))
+            self.assertEqual([row['_order'] for row in rows], list(range(7)))
+
+    def test_picks_up_rows_added_after_its_position(self):
+        rows = iter_keyset(ListItem.objects.filter(list=self.list), ('_order',), '_order', 2)
+        next(rows)
+        ListItem.objects.create(list=self.list, title='Appended', _order=7)
+        self.assertEqual(len(list(rows)), 7)
+
+
+class CloneManyTests(TestCase):
+    def test_no_lists(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(List.objects.cloneMany([]), {})
+
+    def test_clones_active_items(self):
+        user = User.objects.create(username='faria')
+        topic = TopicNode.objects.create(name='Clones', description='')
+        lst = List.objects.create(title='List', topic=topic, creator=user, status=List.PUBLISHED)
+        ListItem.objects.create(list=lst, title='Kept', _order=0)
+        ListItem.objects.create(list=lst, title='Dropped', _order=1, active=False)
+        clones = List.objects.cloneMany(iter([lst.pk]))
+        clone = List.objects.get(pk=clones[lst.pk])
+        self.assertEqual((clone.status, clone.version, clone.parentList_id),
+                         (List.DRAFT, lst.version + 1, lst.pk))
+        self.assertEqual(list(clone.listitem_set.values_list('title', flat=True)), ['Kept'])
+
+
+class TopicLayoutTests(SimpleTestCase):
+    def test_fills_trees_breadth_first(self):
+        parents, levels = layout(10, 2, 2)
+        self.assertEqual(parents, [None, 0, 0, 1, 1, 2, 2, None, 7, 7])
+        self.assertEqual(levels, [0, 1, 1, 2, 2, 2, 2, 0, 1, 1])
+
+    def test_parents_are_one_level_up(self):
+        parents, levels = layout(500, 4, 3)
+        self.assertEqual(len(parents), 500)
+        self.assertEqual(max(levels), 4)
+        for parent, level in zip(parents, levels):
+            if parent is None:
+                self.assertEqual(level, 0)
+            else:
+                self.assertEqual(levels[parent], level - 1)
+
+
+class MemorySearchBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.backend = MemorySearchBackend(sync=False)
+        start = datetime.datetime(2016, 7, 1, tzinfo=timezone.utc)
+        self.backend.bulk_actions(
+            [{'_type': 'topicnode', '_id': pk, 'name': name,
+              'name_complete': {'input': [name], 'payload': {'pk': pk}}}
+             for pk, name in ((1, 'Neuroscience'), (2, 'Neural networks'), (3, 'Networks'))] +
+            [{'_type': 'list', '_id': pk, 'id': pk, 'title': title, 'description': '',
+              'status': status, 'active': True, 'topic': None, 'listItems': [],
+              'dateCreated': start + datetime.timedelta(days=pk)}
+             for pk, title, status in ((1, 'Graph theory', 'PUBLISHED'),
+                                       (2, 'Graph graph databases', 'PUBLISHED'),
+                                       (3, 'Protein folding', 'PUBLISHED'),
+                                       (4, 'Graph drafts', 'DRAFT'))])
+
+    def test_suggest_completes_prefixes(self):
+        self.assertEqual(self.backend.suggest('neur'), [
+            {'id': 2, 'value': 'Neural networks'}, {'id': 1, 'value': 'Neuroscience'}])
+        self.assertEqual(self.backend.suggest('x'), [])
+
+    def test_browse_pages_newest_first(self):
+        ids = []
+        params = {'size': 2}
+        while True:
+            result = self.backend.search(params)
+            ids.extend(item['id'] for item in result['lists'])
+            if result['next'] is None:
+                break
+            params['cursor'] = result['next']
+        self.assertEqual(ids, [3, 2, 1])
+
+    def test_text_query_filters_and_highlights(self):
+        result = self.backend.search({'q': 'graph', 'status': 'PUBLISHED'})
+        self.assertEqual([item['id'] for item in result['lists']], [2, 1])
+        self.assertEqual(result['total'], 2)
+        self.assertEqual(result['lists'][1]['highlight']['title'], ['<em>Graph</em> theory'])
+
+    def test_delete(self):
+        self.assertEqual(self.backend.bulk_actions([
+            {'_op_type': 'delete', '_type': 'list', '_id': 3},
+            {'_op_type': 'delete', '_type': 'list', '_id': 9}])[0], 1)
+        self.assertEqual([item['id'] for item in self.backend.search({})['lists']], [2, 1])
+
+
+class PostgresBrowseTests(TestCase):
+    def test_pages_newest_first(self):
+        user = User.objects.create(username='faria')
+        start = datetime.datetime(2016, 7, 1, tzinfo=timezone.utc)
+        # the last two share a millisecond, so the id breaks the tie
+        for offset in (3000, 1000, 2000, 2000.4):
+            lst = List.objects.create(title='List', creator=user, status=List.PUBLISHED)
+            List.objects.filter(pk=lst.pk).update(
+                dateCreated=start + datetime.timedelta(microseconds=offset * 1000))
+        expected = list(List.objects.order_by('-dateCreated').values_list('id', flat=True))
+        expected[1:3] = sorted(expected[1:3], reverse=True)
+        backend = PostgresSearchBackend()
+        ids = []
+        params = {'size': 1}
+        while True:
+            result = backend.search(params)
+            ids.extend(item['id'] for item in result['lists'])
+            if result['next'] is None:
+                break
+            params['cursor'] = result['next']
+        self.assertEqual(ids, expected)
+
+
+class FailoverSearchBackendTests(SimpleTestCase):
+    class Unavailable(object):
+        name = 'primary'
+
+        def suggest(self, term):
+            raise ConnectionError('N/A', 'down', None)
+
+    class Fallback(object):
+        name = 'fallback'
+
+        def suggest(self, term):
+            return [{'id': 1, 'value': term}]
+
+    def test_fallback_answers_are_degraded(self):
+        backend = FailoverSearchBackend(self.Unavailable(), self.Fallback(), CircuitBreaker(3, 30))
+        self.assertFalse(backend.degraded)
+        self.assertEqual(backend.suggest('neu'), [{'id': 1, 'value': 'neu'}])
+        self.assertTrue(backend.degraded)
+        backend.primary = self.Fallback()
+        backend.suggest('neu')
+        self.assertFalse(backend.degraded)
+
+
+class ReplayOutboxTests(TestCase):
+    def test_applies_newer_changes_and_keeps_them_queued(self):
+        user = User.objects.create(username='faria')
+        topic = TopicNode.objects.create(name='Replays', description='')
+        List.objects.create(title='Old', topic=topic, creator=user)
+        after = SearchOutbox.objects.order_by('-id').values_list('id', flat=True)[0]
+        new = List.objects.create(title='New', topic=topic, creator=user)
+        queued = SearchOutbox.objects.count()
+        backend = MemorySearchBackend(sync=False)
+        last = replay_outbox(backend, 'lists_v2', after, batch_size=1)
+        self.assertEqual(last, SearchOutbox.objects.order_by('-id').values_list('id', flat=True)[0])
+        self.assertEqual(set(backend.docType('list').docs), set([str(new.pk)]))
+        self.assertEqual(SearchOutbox.objects.count(), queued)
+
+
+class TopicEdgeCycleTests(TestCase):
+    def setUp(self):
+        self.a, self.b, self.c, self.d = [
+            TopicNode.objects.create(name=name, description='') for name in 'abcd']
+        TopicEdge.objects.create(parent=self.a, child=self.b, description='')
+        self.edge = TopicEdge.objects.create(parent=self.b, child=self.c, description='')
+
+    def closure(self):
+        return set(TopicClosure.objects.values_list('ancestor_id', 'descendant_id'))
+
+    def test_cycle_is_rejected_before_the_row_is_written(self):
+        before = self.closure()
+        with self.assertRaises(ValidationError):
+            TopicEdge.objects.create(parent=self.c, child=self.a, description='')
+        self.assertEqual(TopicEdge.objects.count(), 2)
+        self.assertEqual(self.closure(), before)
+
+    def test_edited_edge_into_a_cycle_keeps_the_old_paths(self):
+        before = self.closure()
+        self.edge.child = self.a
+        with self.assertRaises(ValidationError):
+            self.edge.save()
+        self.assertEqual(TopicEdge.objects.get(pk=self.edge.pk).child_id, self.c.pk)
+        self.assertEqual(self.closure(), before)
+
+    def test_edited_edge_moves_its_paths(self):
+        self.edge.parent = self.d
+        self.edge.save()
+        self.assertEqual(self.closure(), set([
+            (self.a.pk, self.b.pk), (self.d.pk, self.c.pk)]))
+
+    def test_delete_removes_paths(self):
+        self.edge.delete()
+        self.assertEqual(self.closure(), set([(self.a.pk, self.b.pk)]))
+
+
+class FindCycleNodesTests(SimpleTestCase):
+    def test_only_nodes_on_the_cycle(self):
+        # 1 -> 2 -> 3 -> 2 is a cycle, 4 only hangs below it
+        self.assertEqual(findCycleNodes([(1, 2), (2, 3), (3, 2), (3, 4), (4, 5)]), set([2, 3]))
+
+    def test_acyclic(self):
+        self.assertEqual(findCycleNodes([(1, 2), (2, 3), (1, 3)]), set())
+
+
+class TopicListStatsEdgeTests(TestCase):
+    """Edge and topic changes adjust the counts of the affected ancestors
+    only; the result must match a full recompute"""
+
+    def setUp(self):
+        user = User.objects.create(username='stats')
+        self.topics = [TopicNode.objects.create(name=name, description='') for name in 'abcde']
+        for i, topic in enumerate(self.topics):
+            for _ in range(i + 1):
+                List.objects.create(title='List', topic=topic, creator=user, status=List.PUBLISHED)
+
+    def edge(self, parent, child):
+        return TopicEdge.objects.create(
+            parent=self.topics[parent], child=self.topics[child], description='')
+
+    def assertMatchesRecompute(self):
+        counts = dict(TopicListStats.objects.values_list('topic_id', 'subtreeCount'))
+        TopicListStats.objects.recompute()
+        self.assertEqual(counts, dict(TopicListStats.objects.values_list('topic_id', 'subtreeCount')))
+
+    def test_edge_changes(self):
+        self.edge(0, 1)
+        edge = self.edge(1, 2)
+        self.edge(0, 2)
+        self.edge(2, 3)
+        self.assertMatchesRecompute()
+        edge.parent = self.topics[4]
+        edge.save()
+        self.assertMatchesRecompute()
+        edge.delete()
+        self.assertMatchesRecompute()
+        self.assertEqual(TopicListStats.objects.get(topic=self.topics[0]).subtreeCount, 1 + 2 + 3 + 4)
+
+    def test_topic_delete(self):
+        self.edge(0, 1)
+        self.edge(1, 2)
+        self.topics[1].delete()
+        self.assertMatchesRecompute()
+        self.assertEqual(TopicListStats.objects.get(topic=self.topics[0]).subtreeCount, 1)
+
+
+class InvalidFormResponseMixin(object):
+    """Form errors are ErrorDicts of ErrorLists; every encoder must render
+    their messages"""
+    encoder_name = None
+
+    def setUp(self):
+        self.previous = encoders._encoder
+        encoders._encoder = load_encoder(self.encoder_name)
+        User.objects.create(username='faria')
+
+    def tearDown(self):
+        encoders._encoder = self.previous
+
+    def test_create_errors(self):
+        response = self.client.post(reverse('listapp:list-create', args=[1]),
+                                    {'description': '', 'item-0-title': ''})
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.content.decode('utf-8'))['errors']
+        self.assertEqual(errors['list']['title'], ['This field is required.'])
+        self.assertEqual(errors['item-0']['title'], ['This field is required.'])
+
+    def test_query_errors(self):
+        response = self.client.get(reverse('listapp:list-query'), {'size': 0})
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.content.decode('utf-8'))['errors']
+        self.assertEqual(len(errors['size']), 1)
+
+
+class StdlibInvalidFormResponseTests(InvalidFormResponseMixin, TestCase):
+    encoder_name = 'stdlib'
+
+
+@skipIf(orjson is None, 'orjson is not installed')
+class OrjsonInvalidFormResponseTests(InvalidFormResponseMixin, TestCase):
+    encoder_name = 'orjson'
+
+
+class ListSnapshotTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='faria')
+        topic = TopicNode.objects.create(name='Snapshots', description='')
+        self.list = List.objects.create(title='List', topic=topic, creator=user,
+                                        status=List.PUBLISHED)
+        self.item = ListItem.objects.create(list=self.list, title='First', _order=0)
+        ListItem.objects.create(list=self.list, title='Hidden', _order=1, active=False)
+        self.store = SnapshotStore()
+
+    def test_hit(self):
+        snapshot = ListSnapshot.objects.refresh(self.list.pk)
+        self.assertIsNotNone(snapshot)
+        cached = self.store.get(self.list.pk)
+        self.assertEqual([item['title'] for item in cached.listItems], ['First'])
+        self.assertEqual(cached.item(self.item.pk)['title'], 'First')
+        with self.assertNumQueries(0):
+            self.assertIs(self.store.get(self.list.pk), cached)
+
+    def test_stale(self):
+        ListSnapshot.objects.refresh(self.list.pk)
+        before = self.store.get(self.list.pk)
+        ListItem.objects.filter(pk=self.item.pk).update(title='Renamed', dateModified=timezone.now())
+        self.store.refresh(self.list.pk)
+        after = self.store.get(self.list.pk)
+        self.assertEqual(after.item(self.item.pk)['title'], 'Renamed')
+        self.assertNotEqual(after.etag, before.etag)
+        self.assertGreater(after.lastModified, before.lastModified)
+
+    def test_unpublished(self):
+        ListSnapshot.objects.refresh(self.list.pk)
+        List.objects.filter(pk=self.list.pk).update(status=List.DRAFT)
+        self.assertIsNone(ListSnapshot.objects.refresh(self.list.pk))
+        self.assertFalse(ListSnapshot.objects.filter(list=self.list).exists())
+        self.assertIsNone(self.store.get(self.list.pk))
+
+
+class ListSnapshotSignalTests(TransactionTestCase):
+    """The signal handlers refresh snapshots on commit, which TestCase never reaches"""
+
+    def setUp(self):
+        user = User.objects.create(username='faria')
+        topic = TopicNode.objects.create(name='Snapshots', description='')
+        self.list = List.objects.create(title='List', topic=topic, creator=user,
+                                        status=List.PUBLISHED)
+
+    def test_item_save_rebuilds_published_snapshot(self):
+        item = ListItem.objects.create(list=self.list, title='First', _order=0)
+        self.assertEqual(snapshots.get(self.list.pk).item(item.pk)['title'], 'First')
+        item.title = 'Renamed'
+        item.save()
+        self.assertEqual(snapshots.get(self.list.pk).item(item.pk)['title'], 'Renamed')
+
+    def test_unpublishing_removes_snapshot(self):
+        self.list.status = List.DRAFT
+        self.list.save()
+        self.assertFalse(ListSnapshot.objects.filter(list=self.list).exists())
+        self.assertIsNone(snapshots.get(self.list.pk))
+
+
+@override_settings(ENTITLEMENTS_CHECK_INTERVAL=0, TOPIC_GRAPH_CHECK_INTERVAL=0)
+class EntitlementResolverTests(TestCase):
+    def setUp(self):
+        # stamps restart with every test, so a graph loaded by an earlier
+        # test could carry the same version
+        topicgraph._graph = None
+        self.resolver = EntitlementResolver()
+        user = User.objects.create(username='faria')
+        self.person = Person.objects.create(user=user)
+        self.group = SubscriberGroup.objects.create(name='Lab')
+        Subscriber.objects.create(person=self.person, group=self.group)
+        topic = lambda name: TopicNode.objects.create(name=name, description='')
+        self.root, self.child, self.leaf, self.other = (
+            topic('Biology'), topic('Neuroscience'), topic('Synapses'), topic('Physics'))
+        TopicEdge.objects.create(parent=self.root, child=self.child, description='')
+        TopicEdge.objects.create(parent=self.child, child=self.leaf, description='')
+
+    def subscribe(self, topic, **kwargs):
+        return Subscription.objects.create(group=self.group, topic=topic, **kwargs)
+
+    def entitlements(self):
+        return self.resolver.forUser(self.person.pk)
+
+    def test_subscription_covers_subtopics(self):
+        self.subscribe(self.child)
+        entitlements = self.entitlements()
+        self.assertEqual(entitlements.viewTopics, frozenset([self.child.pk, self.leaf.pk]))
+        self.assertEqual(entitlements.editTopics, frozenset())
+        self.assertIsNone(entitlements.validUntil)
+
+    def test_edit_power_grants_edit_topics(self):
+        self.subscribe(self.child, editPower=True)
+        self.subscribe(self.other)
+        entitlements = self.entitlements()
+        self.assertTrue(entitlements.canEditTopic(self.leaf.pk))
+        self.assertFalse(entitlements.canEditTopic(self.other.pk))
+        self.assertTrue(entitlements.canViewTopic(self.other.pk))
+
+    def test_inactive_and_expired_subscriptions_grant_nothing(self):
+        self.subscribe(self.root, active=False)
+        self.subscribe(self.other, dateExpire=timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(self.entitlements().viewTopics, frozenset())
+
+    def test_entitlements_lapse_at_the_earliest_expiry(self):
+        later = timezone.now() + datetime.timedelta(days=30)
+        soon = timezone.now() + datetime.timedelta(seconds=0.3)
+        self.subscribe(self.other, dateExpire=later)
+        self.subscribe(self.leaf, dateExpire=soon)
+        entitlements = self.entitlements()
+        self.assertEqual(entitlements.validUntil, soon)
+        self.assertTrue(entitlements.canViewTopic(self.leaf.pk))
+        time.sleep(max(0, (soon - timezone.now()).total_seconds()) + 0.05)
+        entitlements = self.entitlements()
+        self.assertFalse(entitlements.canViewTopic(self.leaf.pk))
+        self.assertTrue(entitlements.canViewTopic(self.other.pk))
+        self.assertEqual(entitlements.validUntil, later)
+
+    def test_cached_until_something_changes(self):
+        self.subscribe(self.child)
+        first = self.entitlements()
+        self.assertIs(self.entitlements(), first)
+
+        self.subscribe(self.other)
+        self.assertTrue(self.entitlements().canViewTopic(self.other.pk))
+
+        topic = TopicNode.objects.create(name='Dendrites', description='')
+        TopicEdge.objects.create(parent=self.leaf, child=topic, description='')
+        self.assertTrue(self.entitlements().canViewTopic(topic.pk))
+
+        Subscriber.objects.filter(person=self.person).delete()
+        self.assertEqual(self.entitlements().viewTopics, frozenset())
+
+    def test_visibility_rules(self):
+        self.subscribe(self.child)
+        self.subscribe(self.other, editPower=True)
+        entitlements = self.entitlements()
+        me, someone = self.person.pk, self.person.pk + 1
+
+        def lst(status, topic, creator=someone):
+            return List(status=status, topic_id=topic.pk, creator_id=creator)
+
+        # drafts are private to their creator
+        self.assertTrue(entitlements.canView(lst(List.DRAFT, self.root, me)))
+        self.assertTrue(entitlements.canEdit(lst(List.DRAFT, self.root, me)))
+        self.assertFalse(entitlements.canView(lst(List.DRAFT, self.other)))
+        self.assertFalse(entitlements.canEdit(lst(List.DRAFT, self.other)))
+        # submitted lists go to the editors of their topic
+        self.assertFalse(entitlements.canView(lst(List.SUBMITTED, self.leaf)))
+        self.assertTrue(entitlements.canView(lst(List.SUBMITTED, self.other)))
+        self.assertTrue(entitlements.canEdit(lst(List.SUBMITTED, self.other)))
+        # published lists are read-only, for subscribers of their topic
+        self.assertTrue(entitlements.canView(lst(List.PUBLISHED, self.leaf)))
+        self.assertFalse(entitlements.canView(lst(List.PUBLISHED, self.root)))
+        self.assertFalse(entitlements.canEdit(lst(List.PUBLISHED, self.other, me)))
+        visible = entitlements.filterLists([lst(List.PUBLISHED, self.leaf),
+                                            lst(List.PUBLISHED, self.root)])
+        self.assertEqual([l.topic_id for l in visible], [self.leaf.pk])
+
+
+class MoveItemsTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='faria')
+        topic = TopicNode.objects.create(name='Moves', description='')
+        self.list = List.objects.create(title='List', topic=topic, creator=user)
+        self.items = {}
+        for order, title in enumerate('ABCDE'):
+            self.items[title] = ListItem.objects.create(list=self.list, title=title, _order=order).pk
+
+    def move(self, *moves):
+        return self.list.moveItems([(self.items[title], position) for title, position in moves])
+
+    def titles(self):
+        rows = list(ListItem.objects.filter(list=self.list).order_by('_order').values_list('_order', 'title'))
+        # _order stays dense
+        self.assertEqual([order for order, title in rows], list(range(len(rows))))
+        return ''.join(title for order, title in rows)
+
+    def test_move_up(self):
+        self.assertEqual(self.move(('E', 1)), [1])
+        self.assertEqual(self.titles(), 'AEBCD')
+
+    def test_move_down(self):
+        self.assertEqual(self.move(('A', 3)), [3])
+        self.assertEqual(self.titles(), 'BCDAE')
+
+    def test_unchanged_position(self):
+        self.assertEqual(self.move(('C', 2)), [2])
+        self.assertEqual(self.titles(), 'ABCDE')
+
+    def test_moves_apply_in_order(self):
+        self.assertEqual(self.move(('A', 4), ('E', 0), ('C', 3)), [4, 0, 3])
+        # BCDEA, then EBCDA, then EBDCA
+        self.assertEqual(self.titles(), 'EBDCA')
+
+    def test_positions_are_clamped(self):
+        self.assertEqual(self.move(('C', -5), ('B', 99)), [0, 4])
+        self.assertEqual(self.titles(), 'CADEB')
+
+    def test_item_of_another_list(self):
+        other = List.objects.create(title='Other', topic=self.list.topic, creator=self.list.creator)
+        stranger = ListItem.objects.create(list=other, title='X', _order=0)
+        with self.assertRaises(ListItem.DoesNotExist):
+            self.list.moveItems([(self.items['A'], 4), (stranger.pk, 0)])
+        # the earlier move is rolled back with the batch
+        self.assertEqual(self.titles(), 'ABCDE')
+        self.assertEqual(ListItem.objects.get(pk=stranger.pk)._order, 0)
+
+
+class ListItemsConditionalTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='faria')
+        topic = TopicNode.objects.create(name='Caching', description='')
+        self.list = List.objects.create(title='List', topic=topic, creator=user)
+        self.items = [ListItem.objects.create(list=self.list, title='Item %d' % i, _order=i)
+                      for i in range(3)]
+        self.url = reverse('listapp:list-items', args=[self.list.pk])
+
+    def get(self, etag=None):
+        if etag is None:
+            return self.client.get(self.url)
+        return self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+    def cache_control(self, response):
+        return set(response['Cache-Control'].split(', '))
+
+    def assertRevalidates(self, etag):
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        return response
+
+    def assertChanged(self, etag):
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_draft(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cache_control(response), set(['private', 'no-cache']))
+        etag = response['ETag']
+        self.assertEqual(self.cache_control(self.assertRevalidates(etag)),
+                         set(['private', 'no-cache']))
+
+        item = self.items[1]
+        item.title = 'Edited'
+        item.save()
+        etag = self.assertChanged(etag)
+        self.assertRevalidates(etag)
+
+        self.list.moveItems([(self.items[2].pk, 0)])
+        etag = self.assertChanged(etag)
+        self.assertRevalidates(etag)
+
+    def test_published(self):
+        List.objects.filter(pk=self.list.pk).update(status=List.PUBLISHED)
+        # the signal handlers refresh snapshots on commit, which TestCase never reaches
+        snapshots.refresh(self.list.pk)
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cache_control(response),
+                         set(['public', 'max-age=%d' % settings.LIST_ITEMS_PUBLISHED_MAX_AGE]))
+        with self.assertNumQueries(0):
+            self.assertRevalidates(response['ETag'])
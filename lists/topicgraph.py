@@ -0,0 +1,158 @@
+"""Immutable in-memory snapshot of the TopicEdge DAG.
+
+Each worker holds one TopicGraph, loaded with a single query and stored as
+array-backed CSR (compressed sparse row) adjacency lists in both directions.
+The snapshot is replaced wholesale when the 'topicgraph' VersionStamp, which
+the TopicEdge signal handlers bump, no longer matches the one it was built at.
+"""
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+
+VERSION_STAMP = 'topicgraph'
+
+
+def _csr(size, pairs):
+    """Builds (offsets, targets) arrays for pairs of (source, target) indices.
+    The targets of source i are targets[offsets[i]:offsets[i + 1]]."""
+    counts = [0] * (size + 1)
+    for source, target in pairs:
+        counts[source + 1] += 1
+    for i in range(size):
+        counts[i + 1] += counts[i]
+    offsets = array('i', counts)
+    targets = array('i', [0] * len(pairs))
+    fill = list(counts)
+    for source, target in pairs:
+        targets[fill[source]] = target
+        fill[source] += 1
+    return offsets, targets
+
+
+class TopicGraph(object):
+    def __init__(self, edges, version=0):
+        """edges is an iterable of (parent_id, child_id) pairs"""
+        edges = list(edges)
+        ids = sorted(set(topic_id for edge in edges for topic_id in edge))
+        self.version = version
+        self._ids = array('i', ids)
+        self._index = dict((topic_id, i) for i, topic_id in enumerate(ids))
+        pairs = [(self._index[parent], self._index[child]) for parent, child in edges]
+        self._childOffsets, self._children = _csr(len(ids), pairs)
+        self._parentOffsets, self._parents = _csr(
+            len(ids), [(child, parent) for parent, child in pairs])
+
+    @classmethod
+    def load(cls):
+        from .models import TopicEdge, VersionStamp
+        # read the stamp first: an edge written in between only makes the
+        # snapshot look older than it is and triggers another rebuild
+        version = VersionStamp.objects.current(VERSION_STAMP)
+        return cls(TopicEdge.objects.values_list('parent_id', 'child_id'), version)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _neighbours(self, offsets, targets, i):
+        return targets[offsets[i]:offsets[i + 1]]
+
+    def _degree(self, offsets, topic_id):
+        i = self._index.get(topic_id)
+        if i is None:
+            return 0
+        return offsets[i + 1] - offsets[i]
+
+    def _walk(self, offsets, targets, topic_id, stop=None):
+        i = self._index.get(topic_id)
+        if i is None:
+            return set()
+        seen = set()
+        stack = [i]
+        while stack:
+            for j in self._neighbours(offsets, targets, stack.pop()):
+                if j not in seen:
+                    if j == stop:
+                        return None
+                    seen.add(j)
+                    stack.append(j)
+        return seen
+
+    def children(self, topic_id):
+        i = self._index.get(topic_id)
+        if i is None:
+            return []
+        return [self._ids[j] for j in self._neighbours(self._childOffsets, self._children, i)]
+
+    def parents(self, topic_id):
+        i = self._index.get(topic_id)
+        if i is None:
+            return []
+        return [self._ids[j] for j in self._neighbours(self._parentOffsets, self._parents, i)]
+
+    def isParent(self, topic_id):
+        return self._degree(self._childOffsets, topic_id) > 0
+
+    def isChild(self, topic_id):
+        return self._degree(self._parentOffsets, topic_id) > 0
+
+    def isLeaf(self, topic_id):
+        return self.isChild(topic_id) and not self.isParent(topic_id)
+
+    def isRoot(self, topic_id):
+        return self.isParent(topic_id) and not self.isChild(topic_id)
+
+    def descendants(self, topic_id):
+        """Returns the set of topic ids reachable from topic_id"""
+        seen = self._walk(self._childOffsets, self._children, topic_id)
+        return set(self._ids[j] for j in seen)
+
+    def ancestors(self, topic_id):
+        """Returns the set of topic ids from which topic_id is reachable"""
+        seen = self._walk(self._parentOffsets, self._parents, topic_id)
+        return set(self._ids[j] for j in seen)
+
+    def isAncestorOf(self, ancestor_id, child_id):
+        target = self._index.get(child_id)
+        if target is None or ancestor_id not in self._index:
+            return False
+        return self._walk(self._childOffsets, self._children, ancestor_id, stop=target) is None
+
+
+_graph = None
+_checked = 0
+_lock = threading.Lock()
+
+
+def get_topic_graph():
+    """Returns this worker's TopicGraph snapshot, rebuilding it if the version
+    stamp moved. The stamp is checked at most every TOPIC_GRAPH_CHECK_INTERVAL
+    seconds."""
+    global _graph, _checked
+    graph = _graph
+    if graph is not None and time.time() - _checked < settings.TOPIC_GRAPH_CHECK_INTERVAL:
+        return graph
+    with _lock:
+        if _graph is None or time.time() - _checked >= settings.TOPIC_GRAPH_CHECK_INTERVAL:
+            from .models import VersionStamp
+            if _graph is None or _graph.version != VersionStamp.objects.current(VERSION_STAMP):
+                # swap in the complete new snapshot in one assignment
+                _graph = TopicGraph.load()
+            _checked = time.time()
+        return _graph
+
+
+def invalidate_topic_graph():
+    """Forces the next get_topic_graph() call to check the version stamp"""
+    global _checked
+    _checked = 0
+
+
+def topic_edges_changed():
+    """Marks every worker's TopicGraph snapshot as outdated. Call after writing
+    TopicEdge rows, inside the writing transaction."""
+    from .models import VersionStamp
+    VersionStamp.objects.bump(VERSION_STAMP)
+    transaction.on_commit(invalidate_topic_graph)
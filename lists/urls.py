@@ -5,6 +5,14 @@ app_name = 'listapp'
 urlpatterns = [
     url(r'^$', views.IndexView.as_view(), name='index'),
     url(r'^list/search/$', views.ListSearchView.as_view(), name='list-search'),
+    url(r'^list/query/$', views.ListQueryView.as_view(), name='list-query'),
+    url(r'^search/status/$', views.SearchStatusView.as_view(), name='search-status'),
+    url(r'^metrics/$', views.MetricsView.as_view(), name='metrics'),
+    url(r'^list/export/$', views.ListExportView.as_view(), name='list-export'),
     url(r'^list/(?P<pk>[0-9]+)/create/$', views.ListCreateView.as_view(), name='list-create'),
+    url(r'^list/(?P<pk>[0-9]+)/clone/$', views.ListCloneView.as_view(), name='list-clone'),
+    url(r'^list/(?P<pk>[0-9]+)/versions/$', views.ListVersionsView.as_view(), name='list-versions'),
     url(r'^list/(?P<pk>[0-9]+)/items/$', views.ListItemsView.as_view(), name='list-items'),
+    url(r'^list/(?P<pk>[0-9]+)/items/reorder/$', views.ListItemReorderView.as_view(), name='list-items-reorder'),
+    url(r'^list/(?P<pk>[0-9]+)/items/(?P<item_pk>[0-9]+)/$', views.ListItemDetailView.as_view(), name='list-item-detail'),
 ]
@@ -1,39 +1,72 @@
-import json
-import datetime
-from elasticsearch import Elasticsearch
+import hashlib
+from calendar import timegm
+from itertools import islice
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, Http404, HttpResponseRedirect
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import HttpResponse, Http404, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render
 from django.template import loader
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date, quote_etag
 from django.views import generic
 from django.views.decorators.csrf import csrf_exempt
 
+from . import encoders
+from .cache import suggest_cache
+from .db import iter_keyset
+from .esclient import pool_stats
+from .metrics import registry
+from .search import InvalidCursor, get_search_backend
+from .snapshots import snapshots
 from .models import *
 from .forms import *
 
-es = Elasticsearch([{'host': 'localhost', 'port': 9200}])
-
-def json_serial(obj):
-    if isinstance(obj, datetime.datetime):
-        # for consistency, and to save space, don't return microseconds
-        date = obj.replace(microsecond=0)
-        return date.isoformat()
-    else:
-        raise TypeError ("Type not serializable")
-
 class JsonResponse(HttpResponse):
     def __init__(self, context, status_code, **response_kwargs):
         super(JsonResponse, self).__init__(
-            content=json.dumps(context, default=json_serial),
+            content=encoders.dumps(context),
+            content_type='application/json',
+            status=status_code,
+            **response_kwargs
+        )
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """Streams {key: [row, row, ...], **extra} while rows are being produced,
+    so the first bytes go out before the last row is read and memory use does
+    not grow with the number of rows."""
+    ROWS_PER_CHUNK = 100
+
+    def __init__(self, rows, key, extra=None, status_code=200, **response_kwargs):
+        super(StreamingJsonResponse, self).__init__(
+            streaming_content=self.iter_json(rows, key, extra or {}),
             content_type='application/json',
             status=status_code,
             **response_kwargs
         )
 
+    def iter_json(self, rows, key, extra):
+        dumps = encoders.dumps
+        yield '{%s: [' % dumps(key)
+        chunk = []
+        separator = ''
+        for row in rows:
+            chunk.append(dumps(row))
+            if len(chunk) == self.ROWS_PER_CHUNK:
+                yield separator + ', '.join(chunk)
+                separator = ', '
+                chunk = []
+        if chunk:
+            yield separator + ', '.join(chunk)
+        tail = ''.join(', %s: %s' % (dumps(k), dumps(v))
+                       for k, v in sorted(extra.items()))
+        yield ']%s}' % tail
+
 class JSONResponseMixin(object):
     def render_to_json_response(self, context, status_code=200, **response_kwargs):
         return JsonResponse(
@@ -42,6 +75,15 @@ class JSONResponseMixin(object):
             **response_kwargs
         )
 
+    def render_to_streaming_json_response(self, rows, key, extra=None, status_code=200, **response_kwargs):
+        return StreamingJsonResponse(
+            rows,
+            key,
+            extra,
+            status_code,
+            **response_kwargs
+        )
+
 class IndexView(generic.TemplateView):
     template_name = 'lists/index.html'
 
@@ -54,23 +96,17 @@ class ListSearchView(JSONResponseMixin, generic.View):
     http_method_names = ['options','get']
     
     def get_queryset(self):
-        client = settings.ES_CLIENT
         query = self.request.GET.get('term', '')
-        resp = client.suggest(
-            index=settings.INDEX_NAME,
-            body={
-                'name_complete': {
-                    "text": query,
-                    "completion": {
-                        "field": 'name_complete',
-                    }
-                }
-            }
-        )
-        options = resp['name_complete'][0]['options']
-        data = json.dumps(
-            [{'id': i['payload']['pk'], 'value': i['text']} for i in options]
-        )
+        generation = suggest_cache.generation()
+        data = suggest_cache.get(query, generation)
+        if data is None:
+            backend = get_search_backend()
+            options = backend.suggest(suggest_cache.normalize(query))
+            data = encoders.dumps(options)
+            # fallback answers are kept briefly, so the primary's replace
+            # them soon after it recovers
+            ttl = settings.SUGGEST_CACHE_FALLBACK_TTL if getattr(backend, 'degraded', False) else None
+            suggest_cache.set(query, data, generation, ttl)
         mimetype = 'application/json'
         return HttpResponse(data, mimetype)
     
@@ -123,6 +159,60 @@ class ListSearchView(JSONResponseMixin, generic.View):
         #return self.render_to_json_response(context)
 
 
+class ListQueryView(JSONResponseMixin, generic.View):
+    """Full-text search over the indexed lists.
+
+    Query parameters (see ListQueryForm):
+      - q: text matched against titles, topic names, descriptions and items;
+        without it lists are returned newest first
+      - status: defaults to PUBLISHED
+      - active: defaults to true
+      - topic: restricts results to that topic and its subtopics
+      - dateFrom, dateTo: range of dateCreated
+      - size: page size, up to 100
+      - cursor: the "next" value of the previous response
+    """
+    http_method_names = ['get',]
+
+    def get(self, request, *args, **kwargs):
+        form = ListQueryForm(request.GET)
+        if not form.is_valid():
+            context = {
+                'error_message': 'Invalid query.',
+                'errors': form.errors
+            }
+            return self.render_to_json_response(context, status_code=400)
+        try:
+            context = get_search_backend().search(form.cleaned_data)
+        except InvalidCursor as e:
+            return self.render_to_json_response({'error_message': str(e)}, status_code=400)
+        return self.render_to_json_response(context)
+
+
+class SearchStatusView(JSONResponseMixin, generic.View):
+    """Reports which search backend is serving and the Elasticsearch
+    connection pool of this worker. circuit is null unless SEARCH_BACKEND
+    fails over from Elasticsearch."""
+    http_method_names = ['get',]
+
+    def get(self, request, *args, **kwargs):
+        backend = get_search_backend()
+        context = {
+            'backend': backend.name,
+            'circuit': backend.breaker.state if hasattr(backend, 'breaker') else None,
+            'pools': pool_stats()
+        }
+        return self.render_to_json_response(context)
+
+
+class MetricsView(generic.View):
+    """Serves this worker's request metrics in the Prometheus text format"""
+    http_method_names = ['get',]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4')
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 #@method_decorator(login_required, name='dispatch')
 class ListCreateView(JSONResponseMixin, generic.View):
@@ -131,30 +221,39 @@ class ListCreateView(JSONResponseMixin, generic.View):
     def calcItemFormPrefixes(self):
         prefixes = []
         userdata = self.request.POST.copy()
-        for key in sorted(userdata):
+        for key in userdata:
             if key.startswith('item-') and key.endswith('title'):
                 L = key.rsplit('-', 1) # ['item-j', 'title']
                 prefixes.append(L[0])
-        return prefixes
+        # item-j prefixes are numbered in list order; sort numerically so
+        # that item-10 comes after item-9
+        def sortKey(prefix):
+            suffix = prefix[len('item-'):]
+            return (0, int(suffix), '') if suffix.isdigit() else (1, 0, suffix)
+        return sorted(prefixes, key=sortKey)
 
     def post(self, request, *args, **kwargs):
         user = User.objects.get(username='faria')
         listForm = ListCreateForm(request.POST)
-        if listForm.is_valid():
-            # save list
-            self.list = listForm.save(commit=False)
-            self.list.user = user
-            self.list.save()
-            # list items
-            self.listItems = []
-            prefixes = self.calcItemFormPrefixes()
-            for px in prefixes:
-                itemForm = ListItemCreateForm(request.POST, prefix=px)
-                if itemForm.is_valid():
+        itemForms = [ListItemCreateForm(request.POST, prefix=px)
+                     for px in self.calcItemFormPrefixes()]
+        # validate everything before writing anything
+        invalidItems = [f for f in itemForms if not f.is_valid()]
+        if listForm.is_valid() and not invalidItems:
+            with transaction.atomic():
+                # save list
+                self.list = listForm.save(commit=False)
+                self.list.user = user
+                self.list.save()
+                # list items, inserted at once with their _order precomputed
+                # instead of one save (and one _order lookup) per item
+                self.listItems = []
+                for order, itemForm in enumerate(itemForms):
                     listItem = itemForm.save(commit=False)
                     listItem.list = self.list
-                    listItem.save()
+                    listItem._order = order
                     self.listItems.append(listItem)
+                ListItem.objects.bulk_create(self.listItems)
             context = {
                 'id': self.list.pk,
                 'title': self.list.title,
@@ -165,32 +264,255 @@ class ListCreateView(JSONResponseMixin, generic.View):
             }
             return self.render_to_json_response(context)
         else:
-            print(listForm.errors)
+            errors = dict((f.prefix, f.errors) for f in invalidItems)
+            if listForm.errors:
+                errors['list'] = listForm.errors
             context = {
-                'error_message': 'Invalid list data.'
+                'error_message': 'Invalid list data.',
+                'errors': errors
             }
             return self.render_to_json_response(context, status_code=400)
 
 
 class ListItemsView(JSONResponseMixin, generic.View):
-    """Returns the items for a single List pk in url"""
+    """Returns the items for a single List pk in url, one page at a time.
+
+    Query parameters:
+      - after: the _order of the last item of the previous page (the "next"
+        value of the previous response)
+      - limit: page size, up to settings.LIST_ITEMS_MAX_PAGE_SIZE
+      - fields: comma separated subset of ITEM_FIELDS to return. Skip the
+        unbounded deepDive here and fetch it per item from ListItemDetailView.
+      - stream: if set, ignores limit and streams every remaining item, read
+        in keyset chunks, for exports.
+
+    Published lists are served from their snapshot (see lists.snapshots),
+    usually without any query. Other lists are read from ListItem.
+
+    Responses carry an ETag and Last-Modified, taken from the snapshot or from
+    one aggregate over the list and its items, and a matching If-None-Match or
+    If-Modified-Since gets a 304 without any item being read. Published lists
+    cannot change, so they may be cached publicly for
+    LIST_ITEMS_PUBLISHED_MAX_AGE seconds; other lists must be revalidated on
+    every use.
+    """
     http_method_names = ['get',]
+    ITEM_FIELDS = ListSnapshot.ITEM_FIELDS
+    # always returned so clients can page and fetch single items
+    KEY_FIELDS = ('id', '_order')
 
     def get_queryset(self):
-        filter_kwargs = dict(active=True, list=self.pk)
-        qset = ListItem.objects.filter(**filter_kwargs)
+        filter_kwargs = dict(active=True, list=self.kwargs['pk'])
+        if self.after is not None:
+            filter_kwargs['_order__gt'] = self.after
+        qset = ListItem.objects.filter(**filter_kwargs).order_by('_order')
         return qset
 
+    def parse_params(self):
+        """Reads after, limit and fields from the query string. Raises ValueError if invalid"""
+        params = self.request.GET
+        self.after = int(params['after']) if params.get('after') else None
+        self.limit = int(params.get('limit') or settings.LIST_ITEMS_PAGE_SIZE)
+        if not 0 < self.limit <= settings.LIST_ITEMS_MAX_PAGE_SIZE:
+            raise ValueError('limit must be between 1 and %d' % settings.LIST_ITEMS_MAX_PAGE_SIZE)
+        self.fields = self.ITEM_FIELDS
+        if params.get('fields'):
+            requested = set(params['fields'].split(','))
+            unknown = requested.difference(self.ITEM_FIELDS)
+            if unknown:
+                raise ValueError('unknown fields: %s' % ', '.join(sorted(unknown)))
+            requested.update(self.KEY_FIELDS)
+            self.fields = tuple(f for f in self.ITEM_FIELDS if f in requested)
+
+    def get_validators(self):
+        """Returns (etag, last modified timestamp, status) of the requested
+        page. Raises Http404 if the list does not exist."""
+        query = sorted(self.request.GET.lists())
+        if self.snapshot is not None:
+            key = '%s:%s' % (self.snapshot.etag, query)
+            return (hashlib.md5(key.encode('utf-8')).hexdigest(),
+                    timegm(self.snapshot.lastModified.utctimetuple()), List.PUBLISHED)
+        rows = List.objects.filter(pk=self.kwargs['pk']).annotate(
+            itemsModified=Max('listitem__dateModified'),
+            itemCount=Count('listitem')
+        ).values_list('status', 'dateModified', 'itemsModified', 'itemCount')
+        if not rows:
+            raise Http404('No such list.')
+        status, listModified, itemsModified, itemCount = rows[0]
+        # moving, adding or editing an item bumps its dateModified and
+        # deleting one changes the count
+        lastModified = max(d for d in (listModified, itemsModified) if d is not None)
+        key = '%s:%s:%s:%d:%s' % (self.kwargs['pk'], status, lastModified.isoformat(),
+                                  itemCount, query)
+        etag = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return etag, timegm(lastModified.utctimetuple()), status
+
+    def set_cache_headers(self, response, etag, lastModified, status):
+        response['ETag'] = quote_etag(etag)
+        response['Last-Modified'] = http_date(lastModified)
+        if status == List.PUBLISHED:
+            patch_cache_control(response, public=True,
+                                max_age=settings.LIST_ITEMS_PUBLISHED_MAX_AGE)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_rows(self, limit=None):
+        """Returns the requested items as dicts of self.fields, all remaining
+        ones as an iterator if limit is None"""
+        if self.snapshot is not None:
+            rows = self.snapshot.itemRows(self.after, self.fields)
+            return rows if limit is None else list(islice(rows, limit))
+        if limit is None:
+            return iter_keyset(self.object_list, self.fields, '_order')
+        return list(self.object_list.values(*self.fields)[:limit])
+
     def get_context_data(self):
-        qset = self.object_list
-        fields = ('id','_order', 'title','description', 'deepDive', 'list_id','dateCreated','dateModified')
-        items = list(qset.values(*fields))
+        # fetch one extra row to learn whether there is a next page
+        items = self.get_rows(self.limit + 1)
+        nextCursor = None
+        if len(items) > self.limit:
+            items = items[:self.limit]
+            nextCursor = items[-1]['_order']
         context = {
-            'listItems': items
+            'listItems': items,
+            'next': nextCursor
         }
         return context
 
     def get(self, request, *args, **kwargs):
+        try:
+            self.parse_params()
+        except ValueError as e:
+            return self.render_to_json_response({'error_message': str(e)}, status_code=400)
+        self.snapshot = snapshots.get(int(kwargs['pk']))
+        etag, lastModified, status = self.get_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=lastModified)
+        if response is not None:
+            return self.set_cache_headers(response, etag, lastModified, status)
         self.object_list = self.get_queryset()
-        context = self.get_context_data()
+        if request.GET.get('stream'):
+            response = self.render_to_streaming_json_response(self.get_rows(), 'listItems', {'next': None})
+        else:
+            context = self.get_context_data()
+            response = self.render_to_json_response(context)
+        return self.set_cache_headers(response, etag, lastModified, status)
+
+
+class ListItemDetailView(JSONResponseMixin, generic.View):
+    """Returns a single active item, including its deepDive"""
+    http_method_names = ['get',]
+
+    def get(self, request, *args, **kwargs):
+        snapshot = snapshots.get(int(kwargs['pk']))
+        if snapshot is not None:
+            item = snapshot.item(int(kwargs['item_pk']))
+            items = [item] if item is not None else []
+        else:
+            qset = ListItem.objects.filter(active=True, list=kwargs['pk'], pk=kwargs['item_pk'])
+            items = list(qset.values(*ListItemsView.ITEM_FIELDS))
+        if not items:
+            raise Http404('No such item.')
+        context = {
+            'listItem': items[0]
+        }
+        return self.render_to_json_response(context)
+
+
+class ListExportView(JSONResponseMixin, generic.View):
+    """Streams every published, active list"""
+    http_method_names = ['get',]
+    LIST_FIELDS = ('id','title','description','topic_id','status','version','dateCreated','dateModified')
+
+    def get_queryset(self):
+        filter_kwargs = dict(active=True, status=List.PUBLISHED)
+        qset = List.objects.filter(**filter_kwargs).order_by('id')
+        return qset
+
+    def get(self, request, *args, **kwargs):
+        rows = iter_keyset(self.get_queryset(), self.LIST_FIELDS, 'id')
+        return self.render_to_streaming_json_response(rows, 'lists')
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ListItemReorderView(JSONResponseMixin, generic.View):
+    """Moves items of the List pk in url.
+
+    POST one or more item/position pairs (repeated 'item' and 'position'
+    fields); they are applied in order, in one transaction. A position is the
+    _order value the item should end up at.
+    """
+    http_method_names = ['post',]
+
+    def post(self, request, *args, **kwargs):
+        lst = get_object_or_404(List, pk=kwargs['pk'])
+        if lst.status == List.PUBLISHED:
+            context = {
+                'error_message': 'Published lists cannot be edited.'
+            }
+            return self.render_to_json_response(context, status_code=400)
+        itemIds = request.POST.getlist('item')
+        positions = request.POST.getlist('position')
+        try:
+            moves = [(int(i), int(p)) for i, p in zip(itemIds, positions)]
+        except ValueError:
+            moves = []
+        if not moves or len(itemIds) != len(positions):
+            context = {
+                'error_message': 'Expected matching item and position values.'
+            }
+            return self.render_to_json_response(context, status_code=400)
+        try:
+            finalPositions = lst.moveItems(moves)
+        except ListItem.DoesNotExist as e:
+            return self.render_to_json_response({'error_message': str(e)}, status_code=400)
+        context = {
+            'id': lst.pk,
+            'moves': [{'item': itemId, 'position': position}
+                      for (itemId, _), position in zip(moves, finalPositions)]
+        }
+        return self.render_to_json_response(context)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ListCloneView(JSONResponseMixin, generic.View):
+    """Clones the published List pk in url into a new draft version"""
+    http_method_names = ['post',]
+
+    def post(self, request, *args, **kwargs):
+        lst = get_object_or_404(List, pk=kwargs['pk'])
+        if lst.status != List.PUBLISHED:
+            context = {
+                'error_message': 'Only published lists can be cloned.'
+            }
+            return self.render_to_json_response(context, status_code=400)
+        user = request.user if request.user.is_authenticated() else None
+        clone = lst.clone(user)
+        context = {
+            'id': clone.pk,
+            'title': clone.title,
+            'version': clone.version,
+            'parentList_id': clone.parentList_id,
+            'dateCreated': clone.dateCreated
+        }
+        return self.render_to_json_response(context)
+
+
+class ListVersionsView(JSONResponseMixin, generic.View):
+    """Returns the version history of the List pk in url, newest first"""
+    http_method_names = ['get',]
+
+    def get(self, request, *args, **kwargs):
+        lst = get_object_or_404(List, pk=kwargs['pk'])
+        versions = [{
+            'id': v.pk,
+            'title': v.title,
+            'version': v.version,
+            'status': v.status,
+            'parentList_id': v.parentList_id,
+            'dateCreated': v.dateCreated
+        } for v in lst.versionHistory()]
+        context = {
+            'versions': versions
+        }
         return self.render_to_json_response(context)
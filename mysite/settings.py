@@ -11,7 +11,6 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
-from elasticsearch import Elasticsearch, RequestsHttpConnection
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -40,6 +39,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE_CLASSES = [
+    'lists.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,11 +84,17 @@ DATABASES = {
         'NAME': 'listdev',
         'USER': 'devel',
         'PASSWORD': 'foobar',
-        'HOST': 'db',
-        'PORT': 5432,
+        'HOST': os.environ.get('DB_HOST', 'db'),
+        'PORT': int(os.environ.get('DB_PORT', 5432)),
+        # seconds a connection is kept open and reused across requests
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 300)),
     }
 }
 
+# Persistent connections unchecked for this many seconds are pinged before a
+# request uses them, and reopened if the server or pooler dropped them
+DB_HEALTH_CHECK_INTERVAL = 30
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -128,9 +134,101 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
 
-ES_CLIENT = Elasticsearch(
-    ['http://127.0.0.1:9200/'],
-    connection_class=RequestsHttpConnection
-)
-
-INDEX_NAME = 'listmd'
\ No newline at end of file
+# Elasticsearch nodes, used as listed (no sniffing). The client itself is
+# created on first use by lists.esclient.get_client().
+ES_HOSTS = os.environ.get('ES_HOSTS', 'http://127.0.0.1:9200/').split(',')
+
+# Threads serving requests in each worker process
+WORKER_THREADS = int(os.environ.get('WORKER_THREADS', 10))
+
+# Keep-alive connections per Elasticsearch node, one per thread that may use it
+ES_POOL_SIZE = WORKER_THREADS
+# Default request timeout in seconds; search and suggest use the shorter
+# ES_SEARCH_TIMEOUT and bulk indexing the longer ES_BULK_TIMEOUT. Timed out
+# requests are retried on another node up to ES_MAX_RETRIES times.
+ES_TIMEOUT = 10
+ES_SEARCH_TIMEOUT = 2
+ES_BULK_TIMEOUT = 60
+ES_MAX_RETRIES = 2
+
+INDEX_NAME = 'listmd'
+
+# INDEX_NAME is an alias; es_reindex builds versioned indices (listmd_v1,
+# listmd_v2, ...) and repoints the alias once a build is complete.
+ES_REFRESH_INTERVAL = '1s'
+ES_NUMBER_OF_REPLICAS = 1
+
+# Page /list/query/ results with search_after. Needs Elasticsearch 5 or later;
+# older clusters page with keyset filters and from/size instead.
+ES_SEARCH_AFTER = False
+
+# Search backend: 'elasticsearch' (failing over to PostgreSQL, see below),
+# 'postgres' for PostgreSQL full-text search only, or 'memory' for an index in
+# the process, loaded from the database, for tests and single-worker setups
+# without Elasticsearch
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'elasticsearch')
+
+# Search fails over to PostgreSQL full-text search after this many consecutive
+# Elasticsearch failures, and retries Elasticsearch every SEARCH_RETRY_INTERVAL
+# seconds until it answers again
+SEARCH_FAILURE_THRESHOLD = 3
+SEARCH_RETRY_INTERVAL = 30
+
+# Autocomplete responses are cached per normalized term in a local LRU.
+# Set SUGGEST_CACHE_ALIAS to a shared cache from CACHES (e.g. memcached) to
+# share entries between workers as well. Without one, invalidations go
+# through a VersionStamp row that workers re-read every CHECK_INTERVAL seconds.
+SUGGEST_CACHE_SIZE = 1024
+SUGGEST_CACHE_TTL = 300
+SUGGEST_CACHE_ALIAS = None
+SUGGEST_CACHE_CHECK_INTERVAL = 1.0
+# Seconds responses answered by the fallback backend stay cached while
+# Elasticsearch is unavailable
+SUGGEST_CACHE_FALLBACK_TTL = 10
+
+# Seconds between checks of whether this worker's in-memory TopicGraph is stale
+TOPIC_GRAPH_CHECK_INTERVAL = 1.0
+
+# Per-person topic entitlements cached by lists.entitlements.resolver
+ENTITLEMENTS_CACHE_SIZE = 10000
+ENTITLEMENTS_CACHE_TTL = 300
+ENTITLEMENTS_CHECK_INTERVAL = 1.0
+
+# Page sizes of the list items endpoint
+LIST_ITEMS_PAGE_SIZE = 100
+LIST_ITEMS_MAX_PAGE_SIZE = 1000
+# Rows read per query by the streaming endpoints (see lists.db.iter_keyset)
+STREAM_CHUNK_SIZE = 2000
+# Seconds shared caches may serve the items of a published list unrevalidated
+LIST_ITEMS_PUBLISHED_MAX_AGE = 3600
+
+# Parsed published list snapshots cached per worker by lists.snapshots
+SNAPSHOT_CACHE_SIZE = 2048
+SNAPSHOT_CACHE_TTL = 300
+
+# JSON encoder used by the API views: 'auto' (orjson when installed, else the
+# standard library), 'stdlib', 'orjson' or a dotted path to an encoder class
+JSON_ENCODER = 'auto'
+
+# Per-view request metrics, served by /listapp/metrics/ (see lists.metrics).
+# METRICS_LOG also logs one line per request to the 'lists.metrics' logger.
+METRICS_LOG = False
+
+# Most database queries a request to each URL name may run, whatever the
+# size of the list; streams are charged for their first chunk only. A
+# request over budget logs a warning, or fails when METRICS_ENFORCE_BUDGETS
+# is set, as it is in the tests.
+VIEW_QUERY_BUDGETS = {
+    # the backend query, plus the suggest cache's generation check
+    'listapp:list-search': 2,
+    'listapp:list-query': 2,
+    'listapp:list-export': 2,
+    'listapp:list-create': 8,
+    'listapp:list-clone': 7,
+    'listapp:list-versions': 2,
+    'listapp:list-items': 3,
+    # 6, plus 3 per moved item: room for moving four
+    'listapp:list-items-reorder': 18,
+    'listapp:list-item-detail': 2,
+}
+METRICS_ENFORCE_BUDGETS = False